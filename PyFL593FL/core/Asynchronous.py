@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+asyncio facade of the FL593FL.
+
+All blocking calls, including the initialization of the device, run in one I/O thread
+owning the FL593FL instance, so coroutines never block the event loop and transactions
+never interleave. Calls return awaitables, e.g.
+
+    fl = await AsyncFL593FL().connect(Devices.Dummy)
+    imon = await fl.ld1.get_imon()
+    packets = await fl.ld1.read_many([CMD_IMON, CMD_PMON])
+
+Writes are shielded from cancellation: once submitted they complete, and update the
+register mirror, even if the awaiting task is cancelled meanwhile. Acquired packets can
+be iterated with 'async for packets in fl.updates()' while polling or taking snapshots.
+"""
+
+import asyncio
+import logging
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from .constants import *
+from . import Devices
+from .fl593fl import FL593FL
+
+# Channel methods that change the device state, shielded from cancellation
+WRITE_METHODS = ('write', 'zero')
+
+
+def is_write(name):
+    return name in WRITE_METHODS or name.startswith('set_')
+
+
+class AsyncFL593FL(object):
+    """Runs the calls of an FL593FL in a dedicated I/O thread, returning awaitables."""
+    def __init__(self, fl593fl=None, loop=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.fl593fl = None
+        self.channels = None
+        self.status = self.ld1 = self.ld2 = None
+        if fl593fl is not None:
+            self._attach(fl593fl)
+
+    def _attach(self, fl593fl):
+        self.fl593fl = fl593fl
+        self.channels = [AsyncChannel(self, channel) for channel in fl593fl.channels]
+        self.status, self.ld1, self.ld2 = self.channels
+        return self
+
+    def submit(self, func, *args, **kwargs):
+        """Run any callable in the I/O thread, returns an awaitable of its result."""
+        return asyncio.wrap_future(self.executor.submit(func, *args, **kwargs), loop=self.loop)
+
+    def submit_shielded(self, func, *args, **kwargs):
+        """As submit, but the call completes even if the awaiting task is cancelled."""
+        return asyncio.shield(self.submit(func, *args, **kwargs))
+
+    def connect(self, device_class=Devices.USB, config=1, revalidate=False):
+        """Create and initialize an FL593FL in the I/O thread, returns an awaitable of self."""
+        return self.submit(lambda: self._attach(FL593FL(device_class, config, revalidate)))
+
+    def update(self):
+        return self.submit(self.fl593fl.update)
+
+    def snapshot(self, max_age=None):
+        """Read the update registers of all channels in one device batch, see FL593FL.snapshot."""
+        return self.submit(self.fl593fl.snapshot, max_age)
+
+    def transceive_batch(self, commands, unpack=False):
+        """Transceive a list of commands in one device batch, see Device.transceive_batch."""
+        return self.submit(self.fl593fl.device.transceive_batch, commands, unpack)
+
+    def start_polling(self, subscribe_all=True):
+        return self.submit(self.fl593fl.start_polling, subscribe_all)
+
+    def stop_polling(self):
+        return self.submit(self.fl593fl.stop_polling)
+
+    def updates(self, registers=None, queue_size=UPDATES_QUEUE_SIZE):
+        """Asynchronous iterator of the lists of acquired packets, see Updates."""
+        return Updates(self.fl593fl, registers, queue_size, self.loop or asyncio.get_event_loop())
+
+    def close(self):
+        """Close the FL593FL after pending calls, and stop the I/O thread."""
+        closed = self.submit_shielded(self.fl593fl.close)
+        self.executor.shutdown(wait=False)
+        return closed
+
+
+class AsyncChannel(object):
+    """Channel proxy, calling methods of the channel returns awaitables of their results,
+    e.g. get_imon() or read_many(op_codes)."""
+    def __init__(self, fl593fl, channel):
+        self.fl593fl = fl593fl
+        self.channel = channel
+        self.num = channel.num
+        self.id = channel.id
+
+    def __getattr__(self, name):
+        method = getattr(self.channel, name)
+        if not callable(method):
+            return method
+        submit = self.fl593fl.submit_shielded if is_write(name) else self.fl593fl.submit
+
+        def call(*args, **kwargs):
+            return submit(method, *args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = method.__doc__
+        return call
+
+
+class Updates(object):
+    """Asynchronous iterator of the lists of packets acquired by an FL593FL, limited to
+    [registers] as (channel, op code) if given. If the consumer falls behind by more than
+    [queue_size] lists, the oldest are dropped. Iteration ends on close()."""
+    def __init__(self, fl593fl, registers, queue_size, loop):
+        self.fl593fl = fl593fl
+        self.registers = None if registers is None else frozenset(registers)
+        self.loop = loop
+        self.num_dropped = 0
+        self._pending = collections.deque(maxlen=queue_size)
+        self._waiter = None
+        self._closed = False
+        fl593fl.sinks.append(self.push)
+
+    def push(self, packets):
+        """Sink, called from the acquiring thread."""
+        if self.registers is not None:
+            packets = [packet for packet in packets if (packet.channel, packet.op_code) in self.registers]
+        if packets:
+            self.loop.call_soon_threadsafe(self._put, packets)
+
+    def _put(self, packets):
+        if self._closed:
+            return
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(packets)
+            return
+        if len(self._pending) == self._pending.maxlen:
+            self.num_dropped += 1
+        self._pending.append(packets)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self.loop.create_future()
+        if self._pending:
+            future.set_result(self._pending.popleft())
+        elif self._closed:
+            future.set_exception(StopAsyncIteration())
+        else:
+            self._waiter = future
+        return future
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.fl593fl.sinks.remove(self.push)
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(StopAsyncIteration())
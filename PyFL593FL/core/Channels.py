@@ -7,64 +7,147 @@ Created on 05 Apr 2014 3:27 AM
 
 import time
 import logging
-from constants import *
-from util import memoize_with_expiry, unpack_string
+from .constants import *
+from .util import encode_packet, Reading, SingleFlight, get_refresher, clock, effective_expiry
+from .Registers import RegisterMirror
 
 
 class Channel(object):
+    """Proxy of a device channel. Getters of derived channels take an optional [max_age] in seconds,
+    overriding the default expiry of the cached field, and [min_interval], capping how often the
+    field is read from the device. They return the value with its acquisition time as Reading."""
+    # Return expired values at once while refreshing them in the background (stale-while-revalidate)
+    revalidate = False
+
     def __init__(self, chan_num=0):
         self.log = logging.getLogger(__name__)
         self.device = None
+        self.num = chan_num
         self.id = CHANNEL_DICT_REV[chan_num]
+        # last responses of the device, concurrent reads of the same register share one transaction
+        self.registers = RegisterMirror(chan_num)
+        self._flights = SingleFlight()
 
-    @memoize_with_expiry()
-    def read(self, op_code):
+    def read(self, op_code, max_age=None, min_interval=None):
         """Read a value from field"""
-        command = " ".join([self.id, OP_TYPE_DICT_REV[TYPE_READ], OP_CODE_DICT_REV[op_code]])
-        response = unpack_string(self.device.transceive(command))
-        if response.end_code != ERR_OK:
-            raise ValueError("Reading failed with Error #{}".format(response.end_code))
-        return response
+        return self._cached(self.registers.index(TYPE_READ, op_code), max_age, min_interval)
 
     def write(self, op_code, data):
-        """Write data to a field, handle response/error code"""
-        command = " ".join([self.id, OP_TYPE_DICT_REV[TYPE_WRITE], OP_CODE_DICT_REV[op_code], str(data)])
-        response = unpack_string(self.device.transceive(command))
+        """Write data (bytes, or str of ASCII text) to a field, handle response/error code"""
+        if not isinstance(data, bytes):
+            data = str(data).encode('ascii')
+        response = self.device.transceive_frame(encode_packet(self.num, TYPE_WRITE, op_code, data))
         if response.end_code != ERR_OK:
             raise ValueError("Writing failed with Error #{}".format(response.end_code))
+        self.registers.write_through(response)
         return response
 
-    @memoize_with_expiry()
-    def min(self, op_code):
+    def min(self, op_code, max_age=None, min_interval=None):
         """Read max value of property"""
-        command = " ".join([self.id, OP_TYPE_DICT_REV[TYPE_MIN], OP_CODE_DICT_REV[op_code]])
-        response = unpack_string(self.device.transceive(command))
-        if response.end_code != ERR_OK:
-            raise ValueError("Min failed with Error #{}".format(response.end_code))
-        return response
+        return self._cached(self.registers.index(TYPE_MIN, op_code), max_age, min_interval)
 
-    @memoize_with_expiry()
-    def max(self, op_code):
+    def max(self, op_code, max_age=None, min_interval=None):
         """Read min value of property"""
-        command = " ".join([self.id, OP_TYPE_DICT_REV[TYPE_MAX], OP_CODE_DICT_REV[op_code]])
-        response = unpack_string(self.device.transceive(command))
+        return self._cached(self.registers.index(TYPE_MAX, op_code), max_age, min_interval)
+
+    def read_many(self, op_codes, max_age=None, min_interval=None):
+        """Read several fields, fetching all that are not fresh enough in a single device batch.
+        Returns a dict of op code: packet."""
+        indices = [self.registers.index(TYPE_READ, op_code) for op_code in op_codes]
+        expired = self.expired(indices, max_age, min_interval)
+        if expired:
+            self.store_many(expired, self.device.transceive_many([self.registers.frames[i] for i in expired]))
+        packets = self.registers.packets
+        return {op_code: packets[index] for op_code, index in zip(op_codes, indices)}
+
+    def expired(self, indices, max_age=None, min_interval=None):
+        """Register slots among [indices] that are not fresh enough and have to be read from the device."""
+        expired = []
+        for index in indices:
+            overdue = self._overdue(index, max_age, min_interval)
+            if overdue is None or overdue >= 0:
+                expired.append(index)
+        return expired
+
+    def store_many(self, indices, responses):
+        """Update register slots with the responses to their commands. Raises after storing all
+        successful responses if any of them failed."""
+        failed = []
+        for index, response in zip(indices, responses):
+            if response.end_code == ERR_OK:
+                self.registers.store(index, response)
+            else:
+                failed.append(response)
+        if failed:
+            raise ValueError("Batch failed with Errors {}".format(
+                ', '.join('{}: #{}'.format(OP_CODE_DICT_REV[r.op_code], r.end_code) for r in failed)))
+
+    def age(self, op_code, op_type=TYPE_READ):
+        """Seconds since the cached value of a field was read from the device, None if never read."""
+        return self.registers.age(self.registers.index(op_type, op_code))
+
+    def _overdue(self, index, max_age=None, min_interval=None):
+        """Seconds the mirrored packet of a register slot is past its expiry, see effective_expiry.
+        Negative while fresh, None if never read."""
+        registers = self.registers
+        if registers.packets[index] is None:
+            return None
+        exp = effective_expiry(registers.expiry[index], max_age, min_interval)
+        if exp < 0:
+            return float('-inf')
+        return clock() - registers.timestamps[index] - exp
+
+    def _cached(self, index, max_age, min_interval):
+        """Packet of a register slot from the mirror if fresh enough, otherwise from the device."""
+        packet = self.registers.packets[index]
+        overdue = self._overdue(index, max_age, min_interval)
+        if overdue is not None:
+            if overdue < 0:
+                return packet
+            if self.revalidate and overdue < self.registers.stale[index]:
+                get_refresher().submit((self.num, index), self._flights.do, index, self._fetch, index)
+                return packet
+        return self._flights.do(index, self._fetch, index)
+
+    def _fetch(self, index):
+        """Transceive the command of a register slot and update the mirror."""
+        response = self.device.transceive_frame(self.registers.frames[index])
         if response.end_code != ERR_OK:
-            raise ValueError("Max failed with Error #{}".format(response.end_code))
+            raise ValueError("{} failed with Error #{}".format(OP_TYPE_DICT_REV[response.op_type].capitalize(),
+                                                              response.end_code))
+        self.registers.store(index, response)
         return response
 
 
 class StatusChannel(Channel):
+    # fields read on every update
+    UPDATE_REGISTERS = (CMD_ALARM,)
+
     def __init__(self, *args, **kwargs):
         super(StatusChannel, self).__init__(*args, **kwargs)
         self.log = logging.getLogger(self.__class__.__name__)
+        self._alarm_index = self.registers.index(TYPE_READ, CMD_ALARM)
+
+    @property
+    def alarm_flags(self):
+        """Alarm flags of the last update as bitmask, flag n in bit n. None if never read or not parsable."""
+        packet = self.registers.packets[self._alarm_index]
+        return None if packet is None else packet.value
 
-        self.alarm_states = {n: False for n in range(NUM_ALARMS)}
+    @property
+    def alarm_timestamp(self):
+        """Acquisition time of the last alarm flag update."""
+        packet = self.registers.packets[self._alarm_index]
+        return None if packet is None else packet.timestamp
 
     def initialize(self, device):
         """Once device attached, channel can be initiated using data from device."""
         self.log.debug('Initializing status channel')
         assert device is not None
         self.device = device
+        if device.shared:
+            self.log.debug('Shared device, leaving remote enable as is')
+            return
 
         # loop to avoid initial troubles in communication (device boots?)
         for n in range(MAX_CONN_RETRIES):
@@ -82,80 +165,92 @@ class StatusChannel(Channel):
     def update(self):
         """Update attached properties."""
         self.log.debug('Updating control channel')
-        self.update_alarms()
+        self.read_many(self.UPDATE_REGISTERS)
 
-    def update_alarms(self):
+    def update_alarms(self, max_age=None, min_interval=None):
         """Update all alarm flags."""
         # FIXME: Failure to read alarms should set states to None which can be used by
         # the UI to indicate uncertainty of the alarm states, preventing false negative indication
         self.log.debug('Updating control channel alarms')
-        response = self.read(CMD_ALARM)
-        alarms = map(ord, list(response.data))
-        self.log.debug("Alarm update response: {}".format(alarms))
-        self.alarm_states = {n: alarms[n] == FLAG_ON for n in range(NUM_ALARMS)}
+        response = self.read(CMD_ALARM, max_age=max_age, min_interval=min_interval)
+        self.log.debug("Alarm update response: {}".format(response.data))
+
+    def get_alarm(self, flag, max_age=None, min_interval=None):
+        """State of a single alarm flag, None if the flags could not be parsed. Uses the flags
+        of the last update, unless [max_age] or [min_interval] are given."""
+        if max_age is not None or min_interval is not None:
+            self.update_alarms(max_age=max_age, min_interval=min_interval)
+        if self.alarm_flags is None:
+            return Reading(None, self.alarm_timestamp)
+        return Reading(bool(self.alarm_flags >> flag & 1), self.alarm_timestamp)
 
     def show_alarms(self):
         """Helper method to conveniently print current alarm flag states in human
         readable format."""
         # TODO: Optionally specify flags.
         self.log.log(LOG_LVL_VERBOSE, 'Current alarm flag states:')
-        for key, state in self.alarm_states.items():
-            self.log.info('{0:<7s}: {1:s}'.format(ALARM_FLAG_DICT_REV[key], 'ON' if state else 'OFF'))
+        for flag in range(NUM_ALARMS):
+            self.log.info('{0:<7s}: {1:s}'.format(ALARM_FLAG_DICT_REV[flag], 'ON' if self.get_alarm(flag).value else 'OFF'))
 
-    def get_device_type(self):
+    def get_device_type(self, max_age=None, min_interval=None):
         """Device type. Not really used for anything."""
-        response = self.read(CMD_DEVTYPE)
-        return response.data
+        response = self.read(CMD_DEVTYPE, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
-    def get_model(self):
+    def get_model(self, max_age=None, min_interval=None):
         """Device model."""
-        response = self.read(CMD_MODEL)
-        return response.data
+        response = self.read(CMD_MODEL, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
-    def get_fw_version(self):
+    def get_fw_version(self, max_age=None, min_interval=None):
         """Firmware version."""
-        response = self.read(CMD_FWVER)
-        return response.data
+        response = self.read(CMD_FWVER, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
-    def get_serial(self):
+    def get_serial(self, max_age=None, min_interval=None):
         """Device serial number."""
-        response = self.read(CMD_SERIAL)
-        return response.data
+        response = self.read(CMD_SERIAL, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
-    def get_num_channels(self):
+    def get_num_channels(self, max_age=None, min_interval=None):
         """Number of channels currently supported by the device. Switching modes may affect that."""
-        response = self.read(CMD_CHANCT)
-        return int(response.data)
+        response = self.read(CMD_CHANCT, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
-    def get_output_enable(self):
+    def get_output_enable(self, max_age=None, min_interval=None):
         """Output enabled when all three enable conditions are met:
         XEN, LEN, REN must be true.
         """
-        return self.alarm_states[ALARM_OUT]
+        return self.get_alarm(ALARM_OUT, max_age=max_age, min_interval=min_interval)
 
-    def get_external_enable(self):
+    def get_external_enable(self, max_age=None, min_interval=None):
         """NT pin on connector J102, currently connected to toggle switch at power supply.
         Pulled HIGH when enabled."""
-        return self.alarm_states[ALARM_XEN]
+        return self.get_alarm(ALARM_XEN, max_age=max_age, min_interval=min_interval)
 
-    def get_local_enable(self):
+    def get_local_enable(self, max_age=None, min_interval=None):
         """Toggle switch on FL593FL PCB."""
-        return self.alarm_states[ALARM_LEN]
+        return self.get_alarm(ALARM_LEN, max_age=max_age, min_interval=min_interval)
 
-    def get_remote_enable(self):
+    def get_remote_enable(self, max_age=None, min_interval=None):
         """Software enable. Seems to require active USB connection?"""
-        return self.alarm_states[ALARM_REN]
+        return self.get_alarm(ALARM_REN, max_age=max_age, min_interval=min_interval)
 
     def set_remote_enable(self, state):
-        self.write(CMD_ENABLE, data=chr(FLAG_ON if state else FLAG_OFF))
+        self.write(CMD_ENABLE, data=bytes((FLAG_ON if state else FLAG_OFF,)))
         self.log.debug('Remote enable set to: {}'.format(state))
 
     def close(self):
         # When exiting, disable the remote enable flag to reduce risk of accidental pew pew!
-        self.set_remote_enable(EXIT_REMOTE_ENABLE_STATE)
+        # Unless other processes still use the device
+        if not self.device.shared:
+            self.set_remote_enable(EXIT_REMOTE_ENABLE_STATE)
 
 
 class LaserChannel(Channel):
+    # fields read on every update
+    UPDATE_REGISTERS = (CMD_MODE, CMD_IMON, CMD_PMON, CMD_LIMIT, CMD_SETPOINT)
+
     def __init__(self, *args, **kwargs):
         super(LaserChannel, self).__init__(*args, **kwargs)
         self.log = logging.getLogger(self.__class__.__name__+'[{}]'.format(self.id))
@@ -165,8 +260,10 @@ class LaserChannel(Channel):
         self.log.debug('Initializing with device {}'.format(device))
         assert device is not None
         self.device = device
-        self.zero(zero_limit=AUTO_START_ZERO_LIMIT,
-                  zero_setpoint=AUTO_START_ZERO_SET)
+        # a shared device is reset by the process owning it, not by each client
+        if not device.shared:
+            self.zero(zero_limit=AUTO_START_ZERO_LIMIT,
+                      zero_setpoint=AUTO_START_ZERO_SET)
 
     def zero(self, zero_limit=True, zero_setpoint=True):
         """Zero the limits and/or setpoint for this channel.
@@ -180,20 +277,16 @@ class LaserChannel(Channel):
             self.set_setpoint(0.0)
 
     def update(self):
-        """Call getter methods for channel parameters. With memoization will keep the
-        values updated for sequential reading by a remote interface without slow-down caused
+        """Read the channel parameters in a single device batch. The register mirror keeps the
+        values for sequential reading by a remote interface without slow-down caused
         by transmission delays."""
-        self.log.debug('Updating laser channel '.format(self.id))
-        # Get current value for (_target, action)
-        update_list = [self.get_mode, self.get_imon, self.get_pmon,
-                       self.get_limit, self.get_setpoint]
-        for fn in update_list:
-            fn()
-
-    def get_mode(self):
+        self.log.debug('Updating laser channel {}'.format(self.id))
+        self.read_many(self.UPDATE_REGISTERS)
+
+    def get_mode(self, max_age=None, min_interval=None):
         """Get feedback mode (power or current)"""
-        response = self.read(CMD_MODE)
-        return response.data
+        response = self.read(CMD_MODE, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value, response.timestamp)
 
     def set_mode(self, mode):
         """Set setpoint (current or power, as per tracking mode) in [mA]"""
@@ -206,46 +299,47 @@ class LaserChannel(Channel):
         # response = self.read(CMD_TRACK)
         # return response.data.strip('\x00')
 
-    def get_imon(self):
+    def get_imon(self, max_age=None, min_interval=None):
         """Get current monitor in [mA]"""
-        response = self.read(CMD_IMON)
-        return float(response.data) * 1000.
+        response = self.read(CMD_IMON, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value * 1000., response.timestamp)
 
-    def get_pmon(self):
+    def get_pmon(self, max_age=None, min_interval=None):
         """Get power monitor in [mA]"""
-        response = self.read(CMD_PMON)
-        return float(response.data) * 1000.
+        response = self.read(CMD_PMON, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value * 1000., response.timestamp)
 
-    def get_limit(self):
+    def get_limit(self, max_age=None, min_interval=None):
         """CGet limit (current or power, as per tracking mode) in [mA]"""
-        response = self.read(CMD_LIMIT)
-        return float(response.data) * 1000.
+        response = self.read(CMD_LIMIT, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value * 1000., response.timestamp)
 
     def set_limit(self, value):
         """Set limit (current or power, as per tracking mode) in [mA]"""
         response = self.write(CMD_LIMIT, str(float(value)))
-        return float(response.data) * 1000.
+        return response.value * 1000.
 
-    def get_setpoint(self):
+    def get_setpoint(self, max_age=None, min_interval=None):
         """CGet set setpoint (current or power, as per tracking mode) in [mA]"""
-        response = self.read(CMD_SETPOINT)
-        return float(response.data) * 1000.
+        response = self.read(CMD_SETPOINT, max_age=max_age, min_interval=min_interval)
+        return Reading(response.value * 1000., response.timestamp)
 
     def set_setpoint(self, value):
         """Set setpoint (current or power, as per tracking mode) in [mA]"""
         response = self.write(CMD_SETPOINT, str(float(value)))
-        return float(response.data) * 1000.
+        return response.value * 1000.
 
     def close(self):
         """Set limit and setpoint to zero if configured to do so. Should prevent startup with
-        unsafe values, even if REN is reset."""
-        self.zero(zero_limit=AUTO_EXIT_ZERO_LIMIT,
-                  zero_setpoint=AUTO_EXIT_ZERO_SET)
+        unsafe values, even if REN is reset. Shared devices are left as they are."""
+        if not self.device.shared:
+            self.zero(zero_limit=AUTO_EXIT_ZERO_LIMIT,
+                      zero_setpoint=AUTO_EXIT_ZERO_SET)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    from Devices import USB
+    from .Devices import USB
     with USB() as dev:
         sc = StatusChannel()
         sc.initialize(dev)
@@ -256,11 +350,11 @@ if __name__ == "__main__":
             ld.initialize(dev)
             ld.update()
             time.sleep(0.1)
-            print '{}: {} mA'.format(ld.id, ld.get_imon())
-            print '{}: {} mA'.format(ld.id, ld.get_pmon())
-            print '{}: {} mA'.format(ld.id, ld.get_imon())  # should be cached
-            print '{}: {} mA'.format(ld.id, ld.get_pmon())
+            print('{}: {} mA'.format(ld.id, ld.get_imon().value))
+            print('{}: {} mA'.format(ld.id, ld.get_pmon().value))
+            print('{}: {} mA'.format(ld.id, ld.get_imon().value))  # should be cached
+            print('{}: {} mA'.format(ld.id, ld.get_pmon().value))
             time.sleep(0.2)
-            print '{}: {} mA'.format(ld.id, ld.get_imon())  # should be refreshed
-            print '{}: {} mA'.format(ld.id, ld.get_pmon())
+            print('{}: {} mA'.format(ld.id, ld.get_imon().value))  # should be refreshed
+            print('{}: {} mA'.format(ld.id, ld.get_pmon().value))
             time.sleep(0.1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Device server sharing a single device, e.g. the USB board, between processes.
+
+Clients (see Devices.Socket) connect over a Unix socket or TCP and send fixed size binary
+requests, each a request id and a command frame, answered in order by the request id, a
+status and the response frame. Clients may send many requests before reading responses.
+All requests received at once are run as one device batch, while the device lock
+serializes the batches of all clients. Requests are received into a fixed buffer, and their
+command frames are passed on to the device as memoryviews into it, without copies.
+"""
+
+import os
+import socket
+import logging
+import threading
+import socketserver
+from .constants import *
+from . import util
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection."""
+    def handle(self):
+        log = self.server.log
+        device = self.server.device
+        buf = bytearray(util.REQUEST_SIZE * DEVICE_SERVER_PIPELINE)
+        view = memoryview(buf)
+        num_pending = 0  # bytes received but not answered yet, at the start of the buffer
+        while True:
+            try:
+                num_read = self.request.recv_into(view[num_pending:])
+            except socket.error as error:
+                log.debug("Connection failed: {}".format(error))
+                return
+            if not num_read:
+                return
+            num_pending += num_read
+            num_requests = num_pending // util.REQUEST_SIZE
+            if not num_requests:
+                continue
+            self.request.sendall(self.respond(device, view, num_requests))
+            # keep the start of an incomplete request
+            num_answered = num_requests * util.REQUEST_SIZE
+            buf[:num_pending - num_answered] = buf[num_answered:num_pending]
+            num_pending -= num_answered
+
+    def respond(self, device, requests, num_requests):
+        """Responses to a sequence of requests, run as one device batch."""
+        ids = []
+        frames = []
+        for n in range(num_requests):
+            offset = n * util.REQUEST_SIZE
+            ids.append(util.REQUEST_HEADER.unpack_from(requests, offset)[0])
+            frames.append(requests[offset + util.REQUEST_HEADER.size:offset + util.REQUEST_SIZE])
+        try:
+            responses = [util.encode_response(packet) for packet in device.transceive_many(frames)]
+            status = util.DEVICE_SERVER_OK
+        except Exception as error:
+            self.server.log.error("Transceiving failed: {}".format(error))
+            responses = [b'\0' * EP_PACK_IN] * num_requests
+            status = util.DEVICE_SERVER_ERROR
+        return b''.join(util.RESPONSE_HEADER.pack(request_id, status) + response
+                       for request_id, response in zip(ids, responses))
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DeviceServer(object):
+    def __init__(self, device, location=DEVICE_SERVER_ADDRESS):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.device = device
+        self.location = location
+        self.family, address = util.parse_address(location)
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(address):
+                # left behind by a server that didn't shut down cleanly
+                os.unlink(address)
+            self.server = ThreadingUnixServer(address, RequestHandler)
+        else:
+            self.server = ThreadingTCPServer(address, RequestHandler)
+        self.server.device = device
+        self.server.log = self.log
+        self._thread = None
+
+    def serve_forever(self):
+        self.log.info("Serving device at {}".format(self.location))
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve in a background thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.serve_forever, name='DeviceServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.family == socket.AF_UNIX and os.path.exists(self.location):
+            os.unlink(self.location)
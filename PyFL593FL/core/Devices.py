@@ -7,26 +7,30 @@ Created on 05 Apr 2014 3:27 AM
 Different classes representing interfaces to the FL593FL evaluation board.
 
 USB: Direct access via USB through PyUSB
-Socket: Connection via ZMQ through e.g. a socket or other ZMQ contexts
+Socket: Connection to a device server sharing a device, see DeviceServer.py
 Dummy: Virtual device for debugging. Returns semi-random values
+
+AsyncDevice: Non-blocking access to any of the above, e.g. from an event loop
 """
 
+import array
+import socket
 import logging
-from constants import *
-import util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .constants import *
+from . import util
 try:
     import usb
 except ImportError:
     usb = None
 
-try:
-    import zmq
-except ImportError:
-    zmq = None
-
 
 class Device(object):
     """Generic device interface class."""
+    # Used by other processes as well, its state is not reset by clients attaching or closing
+    shared = False
+
     def __init__(self):
         logging.addLevelName(LOG_LVL_VERBOSE, "VERBOSE")
         self.log = logging.getLogger(__name__)
@@ -34,6 +38,8 @@ class Device(object):
         self.len_receive = None
         self.device = None
         self.num_channels = MAX_NUM_CHAN
+        # serializes transactions, a response has to be read before the next command is sent
+        self.lock = threading.RLock()
 
     def __enter__(self):
         return self
@@ -47,7 +53,44 @@ class Device(object):
 
         For more information on the adopt-a-method program, please contact the author.
         """
-        return command
+        packet = self.transceive_frame(util.encode_command(command))
+        string = util.format_packet(packet)
+        # FIXME: Should have only one return type!
+        if unpack:
+            return packet._replace(string=string)
+        else:
+            return string
+
+    def transceive_frame(self, frame):
+        """Send an encoded command frame and return the decoded response packet.
+
+        The generic device simply echoes the command."""
+        return util.decode_command(frame)
+
+    def transceive_many(self, frames):
+        """Transceive a sequence of encoded command frames in one go, holding the device lock
+        for the whole batch. Returns the list of response packets."""
+        with self.lock:
+            return [self.transceive_frame(frame) for frame in frames]
+
+    def transceive_batch(self, commands, unpack=False):
+        """Transceive a list of command strings in one batch, see transceive_many. Returns the
+        responses as by transceive, with the error in place of commands that could not be encoded."""
+        frames = []
+        results = []
+        for command in commands:
+            try:
+                frames.append(util.encode_command(command))
+                results.append(None)
+            except (ValueError, KeyError) as error:
+                results.append(ValueError("Invalid command {}: {}".format(command, error)))
+        responses = iter(self.transceive_many(frames))
+        for index, result in enumerate(results):
+            if result is None:
+                packet = next(responses)
+                string = util.format_packet(packet)
+                results[index] = packet._replace(string=string) if unpack else string
+        return results
 
     def reset(self):
         """Reset the device, either to recover or prevent fault states on shutdown."""
@@ -113,6 +156,9 @@ class USB(Device):
         assert self.endpoint_in.wMaxPacketSize == EP_PACK_IN
         assert self.endpoint_out.wMaxPacketSize == EP_PACK_OUT
 
+        # Receive buffer, responses are read into it and decoded before the lock is released
+        self._buffer = array.array('B', [0] * EP_PACK_IN)
+
     def _show_configurations(self):
         """Print/log all available configurations."""
         for c, cfg in enumerate(self.device):
@@ -129,15 +175,29 @@ class USB(Device):
         self.log.error("Shouldn't be called by anyone!")
         raise NotImplementedError
 
-    def transceive(self, command, unpack=False):
-        """Send a command string and receive response."""
+    def transceive_frame(self, frame):
+        """Send an encoded command frame and receive the decoded response packet."""
+        verbose = self.log.isEnabledFor(LOG_LVL_VERBOSE)
+        with self.lock:
+            return self._transfer(frame, verbose)
+
+    def transceive_many(self, frames):
+        """Transceive a sequence of encoded command frames, holding the device lock for the whole
+        batch and deciding on logging only once. Returns the list of response packets."""
+        verbose = self.log.isEnabledFor(LOG_LVL_VERBOSE)
+        with self.lock:
+            return [self._transfer(frame, verbose) for frame in frames]
+
+    def _transfer(self, frame, verbose):
+        """Write a command frame and read the response into the receive buffer. Requires the lock."""
         # Write coded command
-        encoded_command = util.encode_command(command)
-        self.log.log(LOG_LVL_VERBOSE, "Command: {}, encoded: {}".format(command, encoded_command))
+        if verbose:
+            self.log.log(LOG_LVL_VERBOSE, "Command: {}, encoded: {}".format(
+                util.format_packet(util.decode_command(frame)), bytes(frame).hex()))
         try:
-            self.endpoint_out.write(encoded_command)
+            self.endpoint_out.write(frame)
         except usb.USBError as error:
-            self.log.error("Could not write to USB: {:s}".format(error))
+            self.log.error("Could not write to USB: {}".format(error))
             raise error
         except ValueError as error:
             self.log.error(error)
@@ -145,17 +205,16 @@ class USB(Device):
 
         # Read back result
         try:
-            response = self.endpoint_in.read(EP_PACK_IN, TIMEOUT)
+            num_read = self.endpoint_in.read(self._buffer, TIMEOUT)
         except usb.USBError as error:
-            self.log.error("No response: {:s}".format(error))
+            self.log.error("No response: {}".format(error))
             raise error
-        self.log.log(LOG_LVL_VERBOSE, "Response: {}, encoded: {}".format(util.decode_response(response), response))
-        
-        # FIXME: Should have only one return type!
-        if unpack:
-            return util.unpack_string(util.decode_response(response))
-        else:
-            return util.decode_response(response)
+        if num_read < EP_PACK_IN:
+            raise ValueError("Incomplete response: {}".format(self._buffer[:num_read].tobytes().hex()))
+        if verbose:
+            self.log.log(LOG_LVL_VERBOSE, "Response: {}, encoded: {}".format(
+                util.decode_response(self._buffer), self._buffer.tobytes().hex()))
+        return util.decode_packet(self._buffer)
 
     def close(self):
         if self.device is not None:
@@ -168,22 +227,105 @@ class Dummy(Device):
 
     Emulates the functionality of a USB or Network attached device.
     """
-    def __init__(self):
+    def __init__(self, *args, **kwargs):
         super(Dummy, self).__init__()
 
-    def transceive(self, command, unpack=False):
-        if unpack:
-            return util.unpack_string(util.fake_data(command))
-        else:
-            return util.fake_data(command)
+    def transceive_frame(self, frame):
+        return util.decode_packet(util.fake_data(util.decode_command(frame)))
 
 
 class Socket(Device):
-    """Allows control via sockets, e.g. over ethernet to a remote server."""
-    def __init__(self, socket_location):
+    """Client of a device server, which shares its device between processes, over a Unix socket
+    or TCP. Requests are pipelined over one persistent connection. To be used by an FL593FL,
+    pass the [address] with e.g. functools.partial(Socket, address=...) as device class."""
+    shared = True
+
+    def __init__(self, config=None, address=DEVICE_SERVER_ADDRESS):
         super(Socket, self).__init__()
-        if zmq is None:
-            raise ImportError('ZMQ not found.')
+        # [config] is the USB configuration passed by FL593FL, the server takes care of it
+        self.location = address
+        self._next_id = 0
+        self.open()
 
-        print socket_location
+    def open(self, *args, **kwargs):
+        family, address = util.parse_address(self.location)
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            connection.connect(address)
+        except socket.error as error:
+            connection.close()
+            raise IOError("Could not connect to device server at {}: {}".format(self.location, error))
+        if family == socket.AF_INET:
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.device = connection
+        self.log.info("Connected to device server at {}".format(self.location))
+
+    def transceive_frame(self, frame):
+        return self.transceive_many([frame])[0]
+
+    def transceive_many(self, frames):
+        """Send the command frames in pipelined requests, then read all responses."""
+        packets = []
+        with self.lock:
+            for start in range(0, len(frames), DEVICE_SERVER_PIPELINE):
+                window = frames[start:start + DEVICE_SERVER_PIPELINE]
+                first = self._next_id
+                self._next_id = (first + len(window)) & 0xFFFFFFFF
+                self.device.sendall(b''.join(util.REQUEST_HEADER.pack((first + n) & 0xFFFFFFFF) + frame
+                                             for n, frame in enumerate(window)))
+                responses = self._receive(len(window) * util.RESPONSE_SIZE)
+                for n in range(len(window)):
+                    offset = n * util.RESPONSE_SIZE
+                    request_id, status = util.RESPONSE_HEADER.unpack_from(responses, offset)
+                    if request_id != (first + n) & 0xFFFFFFFF:
+                        raise IOError("Response {} out of order, expected {}".format(request_id, first + n))
+                    if status != util.DEVICE_SERVER_OK:
+                        raise IOError("Device server failed to transceive {}".format(window[n]))
+                    packets.append(util.decode_packet(responses[offset + util.RESPONSE_HEADER.size:
+                                                                 offset + util.RESPONSE_SIZE]))
+        return packets
+
+    def _receive(self, size):
+        """Memoryview of exactly [size] received bytes, responses are decoded from slices of it."""
+        view = memoryview(bytearray(size))
+        num_received = 0
+        while num_received < size:
+            num_read = self.device.recv_into(view[num_received:])
+            if not num_read:
+                raise IOError("Device server closed the connection")
+            num_received += num_read
+        return view
 
+    def close(self):
+        if self.device is not None:
+            self.device.close()
+        self.device = None
+
+
+class AsyncDevice(object):
+    """Runs the transactions of a device in one dedicated I/O thread owning the device, so
+    callers, e.g. an event loop, never block on it. Calls return concurrent.futures.Future
+    objects, which tornado coroutines can yield."""
+    def __init__(self, device):
+        self.device = device
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, func, *args, **kwargs):
+        """Run any callable in the I/O thread, e.g. a batch of transactions."""
+        return self.executor.submit(func, *args, **kwargs)
+
+    def transceive(self, command, unpack=False):
+        return self.submit(self.device.transceive, command, unpack)
+
+    def transceive_frame(self, frame):
+        return self.submit(self.device.transceive_frame, frame)
+
+    def transceive_many(self, frames):
+        return self.submit(self.device.transceive_many, frames)
+
+    def transceive_batch(self, commands, unpack=False):
+        return self.submit(self.device.transceive_batch, commands, unpack)
+
+    def close(self):
+        """Finish pending transactions and stop the I/O thread. The device is not closed."""
+        self.executor.shutdown(wait=True)
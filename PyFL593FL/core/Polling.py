@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background acquisition of the FL593FL registers.
+
+The Poller owns the device of an FL593FL instance and reads subscribed registers in a
+dedicated thread, each at its own rate. Jobs are kept in a heap ordered by their next
+deadline, all registers due at the same time are read in one device batch. While polled,
+the default expiry of a register is extended beyond its polling interval, so getters are
+served from the register mirror instead of going to the device themselves.
+"""
+
+import heapq
+import logging
+import threading
+from .constants import *
+from .util import clock
+
+
+class Poller(object):
+    def __init__(self, fl593fl):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.fl593fl = fl593fl
+        self.channels = fl593fl.channels
+
+        self._heap = []  # jobs as (next deadline, channel, op code, generation)
+        self._subscriptions = {}  # (channel, op code) -> [subscriber intervals, interval, generation]
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    @staticmethod
+    def default_interval(op_code):
+        """Polling interval derived from the register expiry. Constant registers are read once."""
+        expiry = EXPIRY_DICT[op_code]
+        if expiry < 0:
+            return None
+        return max(expiry, POLL_MIN_INTERVAL)
+
+    @classmethod
+    def normalize_interval(cls, op_code, interval):
+        """Requested polling interval, or the default one, limited to POLL_MIN_INTERVAL."""
+        return cls.default_interval(op_code) if interval is None else max(interval, POLL_MIN_INTERVAL)
+
+    def subscribe(self, channel, op_code, interval=None):
+        """Poll a register of a channel (number) every [interval] seconds. The fastest interval
+        requested by any subscriber applies."""
+        interval = self.normalize_interval(op_code, interval)
+        key = channel, op_code
+        with self._condition:
+            subscription = self._subscriptions.setdefault(key, [[], None, 0])
+            subscription[0].append(interval)
+            faster = interval is not None and (subscription[1] is None or interval < subscription[1])
+            if len(subscription[0]) > 1 and not faster:
+                return
+            self._schedule(channel, op_code, subscription, interval, clock())
+
+    def unsubscribe(self, channel, op_code, interval=None):
+        """Drop a subscription made with [interval], the register is no longer polled once
+        nobody subscribes to it. Otherwise it slows down to the fastest remaining interval."""
+        interval = self.normalize_interval(op_code, interval)
+        key = channel, op_code
+        with self._condition:
+            subscription = self._subscriptions.get(key)
+            if subscription is None or not subscription[0]:
+                return
+            intervals = subscription[0]
+            if interval in intervals:
+                intervals.remove(interval)
+            else:
+                intervals.pop()
+            if not intervals:
+                # the entry and its generation are kept, so stale heap entries stay stale
+                subscription[1] = None
+                subscription[2] += 1
+                self._set_expiry(channel, op_code, None)
+                return
+            polled = [polled for polled in intervals if polled is not None]
+            fastest = min(polled) if polled else None
+            if fastest != subscription[1]:
+                self._schedule(channel, op_code, subscription, fastest, clock() + (fastest or 0))
+
+    def _schedule(self, channel, op_code, subscription, interval, deadline):
+        """Poll a register at a new interval from [deadline] on, invalidating its heap entries by
+        their generation. Requires the condition."""
+        subscription[1] = interval
+        subscription[2] += 1
+        self._set_expiry(channel, op_code, interval)
+        heapq.heappush(self._heap, (deadline, channel, op_code, subscription[2]))
+        self._condition.notify()
+
+    def subscribe_all(self):
+        """Subscribe to the update registers of all channels at their default rates."""
+        for channel in self.channels:
+            for op_code in channel.UPDATE_REGISTERS:
+                self.subscribe(channel.num, op_code)
+
+    def _set_expiry(self, channel, op_code, interval):
+        """Extend the default expiry of a polled register beyond its interval, or restore it."""
+        registers = self.channels[channel].registers
+        index = registers.index(TYPE_READ, op_code)
+        if interval is None:
+            registers.expiry[index] = EXPIRY_DICT[op_code]
+        else:
+            registers.expiry[index] = interval * POLL_EXPIRY_FACTOR
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            for (channel, op_code), subscription in self._subscriptions.items():
+                self._set_expiry(channel, op_code, subscription[1])
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='Poller')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # registers are no longer kept fresh
+        with self._condition:
+            for channel, op_code in self._subscriptions:
+                self._set_expiry(channel, op_code, None)
+
+    def _parallel_mode(self):
+        """LD2 is controlled along with LD1 in parallel mode, as per the PARA flag or channel count."""
+        status = self.channels[CHAN_STATUS]
+        flags = status.alarm_flags
+        if flags is not None and flags >> ALARM_PARA & 1:
+            return True
+        chanct = status.registers.packets[status.registers.index(TYPE_READ, CMD_CHANCT)]
+        return chanct is not None and chanct.value == 1
+
+    def _due(self):
+        """Pop all due jobs, rescheduling periodic ones. Returns the due jobs, or the time to wait."""
+        heap = self._heap
+        now = clock()
+        due = []
+        while heap and heap[0][0] <= now:
+            deadline, channel, op_code, generation = heapq.heappop(heap)
+            subscription = self._subscriptions.get((channel, op_code))
+            if subscription is None or subscription[2] != generation or not subscription[0]:
+                continue
+            due.append((channel, op_code))
+            interval = subscription[1]
+            if interval is not None:
+                # keep the schedule, unless we fell behind by more than an interval
+                heapq.heappush(heap, (max(deadline + interval, now), channel, op_code, generation))
+        if due:
+            return due, None
+        return None, heap[0][0] - now if heap else None
+
+    def poll(self, jobs):
+        """Read the registers of [jobs] as (channel, op code) in one device batch."""
+        skip_ld2 = self._parallel_mode()
+        batch = []
+        for channel, op_code in jobs:
+            if skip_ld2 and channel == CHAN_LD2:
+                continue
+            batch.append((self.channels[channel], self.channels[channel].registers.index(TYPE_READ, op_code)))
+        if not batch:
+            return []
+        responses = self.fl593fl.device.transceive_many([channel.registers.frames[index] for channel, index in batch])
+        packets = []
+        for (channel, index), response in zip(batch, responses):
+            if response.end_code == ERR_OK:
+                channel.registers.store(index, response)
+                packets.append(response)
+            else:
+                self.log.debug("Polling {} failed with Error #{}".format(
+                    OP_CODE_DICT_REV[response.op_code], response.end_code))
+        self.fl593fl.publish(packets)
+        return packets
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    jobs, wait = self._due()
+                    if jobs is not None:
+                        break
+                    self._condition.wait(wait)
+                if not self._running:
+                    return
+            try:
+                self.poll(jobs)
+            except Exception as error:
+                self.log.error("Polling failed: {}".format(error))
+                with self._condition:
+                    self._condition.wait(POLL_ERROR_BACKOFF)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Publish/subscribe stream of the acquired register values for other local processes.
+
+Each batch of packets is published once as a binary frame: a header of sequence number
+and record count, followed by packed records of (timestamp, channel, op code, value), the
+same layout as the records of a recording. The acquisition path only hands the batch to
+a queue, a fan-out thread encodes and sends the frames, so the cost to the acquisition
+loop does not depend on the number of subscribers.
+
+With ZMQ available, frames go out on a PUB socket, which drops frames for subscribers
+that fall behind. Otherwise subscribers connect to a plain Unix or TCP socket, frames are
+length prefixed, and subscribers that can't take a frame right away are disconnected.
+"""
+
+import os
+import socket
+import struct
+import queue
+import logging
+import threading
+from .constants import *
+from . import util
+
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
+PUBLISH_HEADER = struct.Struct('<IH')  # sequence number, number of records
+PUBLISH_RECORD = struct.Struct('<dBBf')  # timestamp, channel, op code, value
+FRAME_LENGTH = struct.Struct('<I')  # prefix of frames on plain sockets
+
+
+def encode_frame(seq, packets):
+    """Frame of the values of a batch of packets."""
+    return PUBLISH_HEADER.pack(seq & 0xFFFFFFFF, len(packets)) + b''.join(
+        PUBLISH_RECORD.pack(packet.timestamp, packet.channel, packet.op_code, packet.value) for packet in packets)
+
+
+def decode_frame(frame):
+    """Sequence number and records as (timestamp, channel, op code, value) of a frame."""
+    seq, count = PUBLISH_HEADER.unpack_from(frame)
+    return seq, [PUBLISH_RECORD.unpack_from(frame, PUBLISH_HEADER.size + n * PUBLISH_RECORD.size)
+                 for n in range(count)]
+
+
+def zmq_endpoint(location):
+    """ZMQ endpoint of a Unix socket path or host:port."""
+    family, address = util.parse_address(location)
+    if family == socket.AF_UNIX:
+        return 'ipc://' + address
+    return 'tcp://{}:{}'.format(*address)
+
+
+def _use_zmq(transport):
+    if transport is None:
+        return zmq is not None
+    if transport == 'zmq' and zmq is None:
+        raise ImportError('ZMQ not found.')
+    return transport == 'zmq'
+
+
+class Publisher(object):
+    """Publishes the values of READ response packets of the registers to subscribers."""
+    def __init__(self, location=PUBLISH_ADDRESS, registers=TELEMETRY_REGISTERS, transport=None,
+                 queue_size=PUBLISH_QUEUE_SIZE):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.location = location
+        self.registers = frozenset(registers)
+        self.zmq = _use_zmq(transport)
+        self.seq = 0
+        self.num_dropped = 0  # packets not published as the queue was full
+        self.num_disconnected = 0  # subscribers dropped for falling behind
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._socket = None
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        if self.zmq:
+            self._context = zmq.Context.instance()
+            self._socket = self._context.socket(zmq.PUB)
+            self._socket.set_hwm(PUBLISH_QUEUE_SIZE)
+            self._socket.bind(zmq_endpoint(self.location))
+        else:
+            family, address = util.parse_address(self.location)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.unlink(address)
+            self._socket = socket.socket(family, socket.SOCK_STREAM)
+            if family == socket.AF_INET:
+                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind(address)
+            self._socket.listen(5)
+            self._threads.append(threading.Thread(target=self._accept, name='PublisherAccept'))
+        self._threads.append(threading.Thread(target=self._run, name='Publisher'))
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+        self.log.info("Publishing at {}".format(self.location))
+
+    def stop(self):
+        if not self._threads:
+            return
+        self._queue.put(None)
+        self._threads[-1].join()
+        if self.zmq:
+            self._socket.close(linger=0)
+        else:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self._socket.close()
+            with self._lock:
+                for subscriber in self._subscribers:
+                    subscriber.close()
+                self._subscribers = []
+            family, address = util.parse_address(self.location)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.unlink(address)
+        for thread in self._threads[:-1]:
+            thread.join()
+        self._threads = []
+
+    def push(self, packets):
+        """Queue packets for publishing. Never blocks, drops the packets if the queue is full."""
+        try:
+            self._queue.put_nowait(packets)
+        except queue.Full:
+            self.num_dropped += len(packets)
+
+    def _accept(self):
+        while True:
+            try:
+                subscriber, _ = self._socket.accept()
+            except socket.error:
+                return
+            subscriber.setblocking(False)
+            with self._lock:
+                self._subscribers.append(subscriber)
+
+    def _run(self):
+        while True:
+            packets = self._queue.get()
+            if packets is None:
+                return
+            packets = [packet for packet in packets
+                       if packet.op_type == TYPE_READ and packet.value is not None
+                       and (packet.channel, packet.op_code) in self.registers]
+            if not packets:
+                continue
+            self.seq += 1
+            frame = encode_frame(self.seq, packets)
+            if self.zmq:
+                self._socket.send(frame)
+            else:
+                self._fan_out(FRAME_LENGTH.pack(len(frame)) + frame)
+
+    def _fan_out(self, data):
+        """Send to all subscribers, disconnecting those that can't take all of it right away."""
+        with self._lock:
+            subscribers = self._subscribers
+            keep = []
+            for subscriber in subscribers:
+                try:
+                    sent = subscriber.send(data)
+                except socket.error:
+                    sent = 0
+                if sent == len(data):
+                    keep.append(subscriber)
+                else:
+                    # a partial frame leaves the stream unusable anyway
+                    self.num_disconnected += 1
+                    self.log.warning("Dropping subscriber falling behind")
+                    subscriber.close()
+            self._subscribers = keep
+
+
+class Subscriber(object):
+    """Receives the frames of a Publisher."""
+    def __init__(self, location=PUBLISH_ADDRESS, transport=None):
+        self.zmq = _use_zmq(transport)
+        if self.zmq:
+            self._socket = zmq.Context.instance().socket(zmq.SUB)
+            self._socket.setsockopt(zmq.SUBSCRIBE, b'')
+            self._socket.connect(zmq_endpoint(location))
+        else:
+            family, address = util.parse_address(location)
+            self._socket = socket.socket(family, socket.SOCK_STREAM)
+            self._socket.connect(address)
+
+    def receive(self):
+        """Sequence number and records as (timestamp, channel, op code, value) of the next frame."""
+        if self.zmq:
+            return decode_frame(self._socket.recv())
+        length, = FRAME_LENGTH.unpack(self._read(FRAME_LENGTH.size))
+        return decode_frame(self._read(length))
+
+    def _read(self, size):
+        view = memoryview(bytearray(size))
+        num_received = 0
+        while num_received < size:
+            num_read = self._socket.recv_into(view[num_received:])
+            if not num_read:
+                raise IOError("Publisher closed the connection")
+            num_received += num_read
+        return view
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Continuous recording of acquired register values to disk.
+
+A session is a directory holding an append-only file of fixed width records (timestamp,
+channel, op code, value) behind a short header, readable as NumPy memmap. Samples are
+handed over from the acquisition path through a bounded queue and written in chunks by
+a dedicated writer thread, so acquisition never waits for the disk. When the queue is
+full, samples are dropped and counted rather than blocking. As records have a fixed
+width, a file cut short by a crash stays readable up to its last complete record.
+
+The samples file is split into segments of a fixed number of records. Whenever a segment
+is complete, its time span and byte offset are appended to a sparse index file. Range
+queries binary search the index and memory map only the segments overlapping the range,
+plus the yet unindexed tail. Segments are in acquisition order, so are their time spans.
+
+For overviews of long sessions, each register is also downsampled as it is recorded into
+a pyramid of levels, each aggregating RECORDING_PYRAMID_FACTOR buckets of the level below
+into one (time span, min, max, mean) bucket. Each level of each register is a file of its
+own, so queries pick the level fitting a point budget in a few binary searches.
+"""
+
+import os
+import queue
+import struct
+import logging
+import threading
+from .constants import *
+from .util import clock
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RECORDING_MAGIC = b'FL593REC'
+INDEX_MAGIC = b'FL593IDX'
+PYRAMID_MAGIC = b'FL593PYR'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct('<8sII')  # magic, version, record size
+SAMPLES_FILE = 'samples.bin'
+INDEX_FILE = 'index.bin'
+PYRAMID_FILE = 'pyramid_{channel}_{op_code}_{level}.bin'
+if np is not None:
+    RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('channel', 'u1'), ('op_code', 'u1'), ('value', '<f4')])
+    # time span, byte offset past the samples file header and number of records of a segment
+    INDEX_DTYPE = np.dtype([('t_start', '<f8'), ('t_end', '<f8'), ('offset', '<u8'), ('count', '<u8')])
+    # time span, minimum, maximum and mean of a bucket of [count] samples
+    BUCKET_DTYPE = np.dtype([('t_start', '<f8'), ('t_end', '<f8'), ('min', '<f4'), ('max', '<f4'),
+                             ('mean', '<f4'), ('count', '<u4')])
+else:
+    RECORD_DTYPE = INDEX_DTYPE = BUCKET_DTYPE = None
+
+
+class Recorder(object):
+    """Writes the register values of READ response packets of a session to disk."""
+    def __init__(self, path, registers=TELEMETRY_REGISTERS, queue_size=RECORDING_QUEUE_SIZE,
+                 segment_size=RECORDING_SEGMENT_SIZE):
+        if np is None:
+            raise ImportError('NumPy not found.')
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.registers = frozenset(registers)
+        self.num_dropped = 0
+        self.num_written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._file = None
+        self._index_file = None
+        self._pyramid = None
+
+        self.segment_size = segment_size
+        self._segment = None  # [t_start, t_end, offset, count] of the open segment
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._file = open_samples(self.path)
+        self._index_file = open_index(self.path)
+        self._segment = open_segment(self.path)
+        if self._segment[3] >= self.segment_size:
+            # left unindexed by a crash, or the segment size changed
+            self._close_segment()
+        self._pyramid = Pyramid(self.path)
+        self._thread = threading.Thread(target=self._run, name='Recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Write all queued samples and close the session."""
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=RECORDING_STOP_TIMEOUT)
+            except queue.Full:
+                self.log.error("Writer not draining the queue, queued samples are lost")
+        self._thread.join(RECORDING_STOP_TIMEOUT)
+        self._thread = None
+        self._file.close()
+        self._index_file.close()
+        self._file = self._index_file = None
+        self._pyramid.close()
+        self._pyramid = None
+
+    def push(self, packets):
+        """Queue packets for writing. Never blocks, drops the packets if the writer can't keep up."""
+        try:
+            self._queue.put_nowait(packets)
+        except queue.Full:
+            self.num_dropped += len(packets)
+
+    def _records(self, batches):
+        """Records of the recorded READ response packets in a list of packet batches."""
+        samples = [(packet.timestamp, packet.channel, packet.op_code, packet.value)
+                   for packets in batches for packet in packets
+                   if packet.op_type == TYPE_READ and packet.value is not None
+                   and (packet.channel, packet.op_code) in self.registers]
+        return np.array(samples, dtype=RECORD_DTYPE)
+
+    def write(self, records):
+        """Append a chunk of records in a single write, then index the segments it completes
+        and add the records to the pyramid."""
+        self._file.write(records.tobytes())
+        self._file.flush()
+        self.num_written += len(records)
+
+        segment = self._segment
+        start = 0
+        while start < len(records):
+            if segment[3] >= self.segment_size:
+                self._close_segment()
+            end = min(len(records), start + self.segment_size - segment[3])
+            timestamps = records['timestamp'][start:end]
+            segment[0] = min(segment[0], timestamps.min())
+            segment[1] = max(segment[1], timestamps.max())
+            segment[3] += end - start
+            start = end
+            if segment[3] >= self.segment_size:
+                self._close_segment()
+        self._pyramid.append(records)
+
+    def _close_segment(self):
+        """Index the open segment and open the next one."""
+        segment = self._segment
+        self._index_file.write(np.array([tuple(segment)], dtype=INDEX_DTYPE).tobytes())
+        self._index_file.flush()
+        segment[:] = [float('inf'), float('-inf'), segment[2] + segment[3] * RECORD_DTYPE.itemsize, 0]
+
+    def _run(self):
+        running = True
+        while running:
+            batches = [self._queue.get()]
+            # gather what arrives until the chunk is full or due to be flushed
+            deadline = clock() + RECORDING_FLUSH_INTERVAL
+            while batches[-1] is not None and len(batches) < RECORDING_CHUNK_SIZE:
+                timeout = deadline - clock()
+                if timeout <= 0:
+                    break
+                try:
+                    batches.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in batches:
+                running = False
+                batches = batches[:batches.index(None)]
+            try:
+                records = self._records(batches)
+                if len(records):
+                    self.write(records)
+            except Exception as error:
+                # keep draining the queue, so stop() and the acquisition never wait on us
+                self.log.error("Writing recording failed: {}".format(error))
+
+
+def aggregate(buckets):
+    """Merge the rows of a 2D array of buckets into one bucket each."""
+    merged = np.zeros(len(buckets), dtype=BUCKET_DTYPE)
+    counts = buckets['count'].sum(axis=1)
+    merged['t_start'] = buckets['t_start'][:, 0]
+    merged['t_end'] = buckets['t_end'][:, -1]
+    merged['min'] = buckets['min'].min(axis=1)
+    merged['max'] = buckets['max'].max(axis=1)
+    merged['mean'] = (buckets['mean'].astype(np.float64) * buckets['count']).sum(axis=1) / counts
+    merged['count'] = counts
+    return merged
+
+
+def samples_to_buckets(records):
+    """Buckets of single samples."""
+    buckets = np.zeros(len(records), dtype=BUCKET_DTYPE)
+    buckets['t_start'] = buckets['t_end'] = records['timestamp']
+    buckets['min'] = buckets['max'] = buckets['mean'] = records['value']
+    buckets['count'] = 1
+    return buckets
+
+
+class Pyramid(object):
+    """Incrementally downsampled levels of the recorded registers of a session."""
+    def __init__(self, path, factor=RECORDING_PYRAMID_FACTOR, levels=RECORDING_PYRAMID_LEVELS):
+        self.path = path
+        self.factor = factor
+        self.levels = levels
+        self._pending = {}  # (channel, op code) -> buckets of each level not yet merged
+        self._files = {}  # (channel, op code, level) -> open level file
+
+    def append(self, records):
+        """Add a chunk of samples, writing the buckets it completes on every level."""
+        keys = records['channel'].astype(np.uint16) << 8 | records['op_code']
+        for key in np.unique(keys):
+            channel, op_code = int(key) >> 8, int(key) & 0xFF
+            buckets = samples_to_buckets(records[keys == key])
+            pending = self._pending.setdefault((channel, op_code), [buckets[:0]] * self.levels)
+            for level in range(1, self.levels + 1):
+                buckets = np.concatenate((pending[level - 1], buckets))
+                complete = len(buckets) // self.factor * self.factor
+                pending[level - 1] = buckets[complete:]
+                if not complete:
+                    break
+                buckets = aggregate(buckets[:complete].reshape(-1, self.factor))
+                self._write(channel, op_code, level, buckets)
+
+    def flush(self):
+        """Write the incomplete buckets of all levels, e.g. at the end of a session."""
+        for (channel, op_code), pending in self._pending.items():
+            carry = pending[0][:0]
+            for level in range(1, self.levels + 1):
+                buckets = np.concatenate((pending[level - 1], carry))
+                pending[level - 1] = buckets[:0]
+                if len(buckets):
+                    carry = aggregate(buckets[np.newaxis])
+                    self._write(channel, op_code, level, carry)
+
+    def close(self):
+        self.flush()
+        for level_file in self._files.values():
+            level_file.close()
+        self._files = {}
+
+    def _write(self, channel, op_code, level, buckets):
+        level_file = self._files.get((channel, op_code, level))
+        if level_file is None:
+            level_file = _open(os.path.join(self.path, PYRAMID_FILE.format(channel=channel, op_code=op_code, level=level)),
+                               PYRAMID_MAGIC, BUCKET_DTYPE)
+            self._files[channel, op_code, level] = level_file
+        level_file.write(buckets.tobytes())
+        level_file.flush()
+
+
+def _open(filename, magic, dtype):
+    """Open a record file for appending, writing the header to new files. A partial record
+    left by a crash is cut off, so appended records stay aligned."""
+    size = os.path.getsize(filename) if os.path.exists(filename) else 0
+    record_file = open(filename, 'ab')
+    if size == 0:
+        record_file.write(RECORDING_HEADER.pack(magic, RECORDING_VERSION, dtype.itemsize))
+        record_file.flush()
+    elif (size - RECORDING_HEADER.size) % dtype.itemsize:
+        record_file.truncate(size - (size - RECORDING_HEADER.size) % dtype.itemsize)
+    return record_file
+
+
+def _map(filename, magic, dtype, start=0, stop=None):
+    """Memory map the complete records [start:stop] of a record file."""
+    with open(filename, 'rb') as record_file:
+        header = record_file.read(RECORDING_HEADER.size)
+    if len(header) < RECORDING_HEADER.size:
+        raise ValueError("Not a recording: {}".format(filename))
+    file_magic, version, record_size = RECORDING_HEADER.unpack(header)
+    if file_magic != magic or record_size != dtype.itemsize:
+        raise ValueError("Not a recording: {}".format(filename))
+    num_records = (os.path.getsize(filename) - RECORDING_HEADER.size) // record_size
+    stop = num_records if stop is None else min(stop, num_records)
+    if stop <= start:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=RECORDING_HEADER.size + start * record_size,
+                     shape=(stop - start,))
+
+
+def open_samples(path):
+    """Open the samples file of a session for appending."""
+    return _open(os.path.join(path, SAMPLES_FILE), RECORDING_MAGIC, RECORD_DTYPE)
+
+
+def open_index(path):
+    """Open the index file of a session for appending."""
+    return _open(os.path.join(path, INDEX_FILE), INDEX_MAGIC, INDEX_DTYPE)
+
+
+def open_segment(path):
+    """State of the last, incomplete segment of a session as [t_start, t_end, offset, count]."""
+    session = Session(path)
+    tail = session.tail()
+    if not len(tail):
+        return [float('inf'), float('-inf'), session.tail_offset(), 0]
+    return [tail['timestamp'].min(), tail['timestamp'].max(), session.tail_offset(), len(tail)]
+
+
+def read_samples(path):
+    """Memory map the complete records of the samples file of a session."""
+    if np is None:
+        raise ImportError('NumPy not found.')
+    return _map(os.path.join(path, SAMPLES_FILE), RECORDING_MAGIC, RECORD_DTYPE)
+
+
+class Session(object):
+    """Time range queries over a recorded session, which may still be recorded to."""
+    def __init__(self, path):
+        if np is None:
+            raise ImportError('NumPy not found.')
+        self.path = path
+        self.samples_file = os.path.join(path, SAMPLES_FILE)
+        self.index_file = os.path.join(path, INDEX_FILE)
+
+    def index(self):
+        """Memory map of the index of the completed segments."""
+        if not os.path.exists(self.index_file):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return _map(self.index_file, INDEX_MAGIC, INDEX_DTYPE)
+
+    def _records(self, offset, stop=None):
+        """Memory map of the samples from byte [offset] up to record [stop]."""
+        return _map(self.samples_file, RECORDING_MAGIC, RECORD_DTYPE,
+                    offset // RECORD_DTYPE.itemsize, stop)
+
+    def tail_offset(self, index=None):
+        """Byte offset of the first sample not covered by the index."""
+        index = self.index() if index is None else index
+        if not len(index):
+            return 0
+        return int(index['offset'][-1] + index['count'][-1] * RECORD_DTYPE.itemsize)
+
+    def tail(self, index=None):
+        """Memory map of the samples not covered by the index."""
+        return self._records(self.tail_offset(index))
+
+    def range(self, t_start, t_end, channel=None, op_code=None):
+        """Samples taken between [t_start] and [t_end], optionally of one channel and/or register.
+        Only the segments overlapping the range are read."""
+        index = self.index()
+        # first segment ending after t_start, up to the last one starting before t_end
+        first = np.searchsorted(index['t_end'], t_start, side='left')
+        last = np.searchsorted(index['t_start'], t_end, side='right')
+        parts = []
+        if first < last:
+            offset = int(index['offset'][first])
+            stop = (int(index['offset'][last - 1]) // RECORD_DTYPE.itemsize) + int(index['count'][last - 1])
+            parts.append(self._records(offset, stop))
+        if last == len(index):
+            parts.append(self.tail(index))
+        selected = []
+        for records in parts:
+            mask = (records['timestamp'] >= t_start) & (records['timestamp'] <= t_end)
+            if channel is not None:
+                mask &= records['channel'] == channel
+            if op_code is not None:
+                mask &= records['op_code'] == op_code
+            selected.append(records[mask])
+        if not selected:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.concatenate(selected)
+
+    def _level(self, channel, op_code, level):
+        """Memory map of a pyramid level of a register, None if there is none."""
+        filename = os.path.join(self.path, PYRAMID_FILE.format(channel=channel, op_code=op_code, level=level))
+        if not os.path.exists(filename):
+            return None
+        return _map(filename, PYRAMID_MAGIC, BUCKET_DTYPE)
+
+    def overview(self, channel, op_code, t_start, t_end, max_points):
+        """Buckets of a register between [t_start] and [t_end] from the finest level, raw samples
+        included, with no more than [max_points] buckets. If none fits, the coarsest level."""
+        buckets = None
+        level = 1
+        while True:
+            level_buckets = self._level(channel, op_code, level)
+            if level_buckets is None:
+                break
+            # buckets ending after t_start, up to the last one starting before t_end
+            first = np.searchsorted(level_buckets['t_end'], t_start, side='left')
+            last = np.searchsorted(level_buckets['t_start'], t_end, side='right')
+            if level == 1 and last - first <= max_points and level_buckets['count'][first:last].sum() <= max_points:
+                break
+            buckets = level_buckets[first:last]
+            if len(buckets) <= max_points:
+                return buckets
+            level += 1
+        if buckets is None:
+            return samples_to_buckets(self.range(t_start, t_end, channel, op_code))
+        return buckets
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Mirror of the device registers of a single channel.
+
+One slot per op type (READ, MIN, MAX) and op code, holding the last response packet,
+the (monotonic) time it was acquired and a version counter that increments with every
+update. Slots are addressed by a fixed index, see RegisterMirror.index, so looking up
+a cached value is a list/array access rather than a dict lookup, and the memory used
+stays the same no matter how long the mirror is in use.
+"""
+
+import array
+from .constants import *
+from .util import FIXED_FRAMES, clock
+
+# Op types and op codes mirrored, in slot order
+MIRRORED_OP_TYPES = (TYPE_READ, TYPE_MIN, TYPE_MAX)
+MIRRORED_OP_CODES = tuple(sorted(OP_CODE_DICT.values()))
+NUM_SLOTS = len(MIRRORED_OP_TYPES) * len(MIRRORED_OP_CODES)
+
+# SLOT_INDEX[op_type][op_code] -> slot, None for op types/codes not mirrored
+SLOT_INDEX = [None] * 256
+for _t, _op_type in enumerate(MIRRORED_OP_TYPES):
+    SLOT_INDEX[_op_type] = [None] * 256
+    for _c, _op_code in enumerate(MIRRORED_OP_CODES):
+        SLOT_INDEX[_op_type][_op_code] = _t * len(MIRRORED_OP_CODES) + _c
+
+
+class RegisterMirror(object):
+    """Fixed size cache of the registers of one channel."""
+    __slots__ = ('channel', 'frames', 'packets', 'timestamps', 'versions', 'expiry', 'stale')
+
+    def __init__(self, channel):
+        self.channel = channel
+        slots = [(op_type, op_code) for op_type in MIRRORED_OP_TYPES for op_code in MIRRORED_OP_CODES]
+        # precompiled command frame to refresh each slot
+        self.frames = [FIXED_FRAMES[op_type][channel][op_code] for op_type, op_code in slots]
+        self.packets = [None] * NUM_SLOTS
+        self.timestamps = array.array('d', [0.0] * NUM_SLOTS)
+        self.versions = array.array('L', [0] * NUM_SLOTS)
+        # default expiry and stale-while-revalidate window per slot
+        self.expiry = array.array('d', [EXPIRY_DICT[op_code] for _, op_code in slots])
+        self.stale = array.array('d', [STALE_DICT[op_code] for _, op_code in slots])
+
+    @staticmethod
+    def index(op_type, op_code):
+        """Slot of an op type and op code."""
+        try:
+            index = SLOT_INDEX[op_type][op_code]
+        except (IndexError, TypeError):
+            index = None
+        if index is None:
+            raise ValueError("Register not mirrored: {}, {}".format(op_type, op_code))
+        return index
+
+    def store(self, index, packet):
+        """Update a slot with a fresh packet."""
+        self.packets[index] = packet
+        self.timestamps[index] = clock()
+        self.versions[index] += 1
+
+    def write_through(self, packet):
+        """Update the READ slot of a written register from the echo in the WRITE response,
+        and expire the registers that depend on it."""
+        op_code = packet.op_code
+        if op_code in WRITE_THROUGH:
+            self.store(SLOT_INDEX[TYPE_READ][op_code], packet._replace(op_type=TYPE_READ))
+        for dependent in INVALIDATE_DICT.get(op_code, ()):
+            self.invalidate(SLOT_INDEX[TYPE_READ][dependent])
+
+    def invalidate(self, index):
+        """Expire a slot, the next read will go to the device. The last packet is kept."""
+        self.timestamps[index] = float('-inf')
+
+    def age(self, index):
+        """Seconds since the slot was updated, None if it never was."""
+        if self.packets[index] is None:
+            return None
+        return clock() - self.timestamps[index]
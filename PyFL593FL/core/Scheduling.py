@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fair sharing of a device between clients sending commands, e.g. web clients.
+
+Each client has a queue of commands and a token bucket limiting its rate. A dispatcher
+thread serves the clients round-robin, one command at a time, so a client flooding the
+device with commands only delays its own. Commands turning the output off (writing 0 to
+ENABLE, SETPOINT or LIMIT) skip the queues and are never rate limited, though only a few
+may be pending per client.
+
+A batch of commands runs at once in a single device batch as soon as its client has a
+token. It costs a token per command though, so the client waits longer afterwards. The
+commands of a batch turning the output off are split off and skip the queue, the others
+wait their turn. The responses are returned in the order of the batch all the same.
+"""
+
+import logging
+import threading
+import collections
+from concurrent.futures import Future, CancelledError
+from .constants import *
+from .util import unpack_string, clock
+
+
+class SchedulerFull(Exception):
+    """The command queue of a client is full."""
+
+
+def is_priority(command):
+    """Whether a command string turns the output off, e.g. "LD1 WRITE ENABLE 0"."""
+    try:
+        packet = unpack_string(command)
+        return (packet.op_type == TYPE_WRITE and packet.op_code in SCHEDULER_PRIORITY_OP_CODES
+                and float(packet.data) == 0)
+    except (ValueError, KeyError, AttributeError):
+        return False
+
+
+def join_batch(future, parts):
+    """Complete [future] with the responses of a batch split into [parts], as (future of the
+    responses, indices of the commands in the batch). A failed part fails its commands only."""
+    lock = threading.Lock()
+    pending = [len(parts)]
+
+    def done(_):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        if not future.set_running_or_notify_cancel():
+            return
+        responses = [None] * sum(len(indices) for _, indices in parts)
+        for part, indices in parts:
+            if part.cancelled():
+                results = [CancelledError()] * len(indices)
+            elif part.exception() is not None:
+                results = [part.exception()] * len(indices)
+            else:
+                results = part.result()
+            for index, response in zip(indices, results):
+                responses[index] = response
+        future.set_result(responses)
+
+    for part, _ in parts:
+        part.add_done_callback(done)
+
+
+class ClientQueue(object):
+    """Commands, token bucket and counters of one client."""
+    __slots__ = ('name', 'commands', 'tokens', 'updated', 'num_priority', 'counters')
+
+    def __init__(self, name, burst):
+        self.name = name
+        self.commands = collections.deque()  # (future, command or list of commands, unpack)
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.num_priority = 0  # pending jobs skipping the queue
+        self.counters = dict(submitted=0, completed=0, failed=0, priority=0, throttled=0, rejected=0)
+
+
+class CommandScheduler(object):
+    def __init__(self, device, rate=SCHEDULER_RATE, burst=SCHEDULER_BURST, queue_size=SCHEDULER_QUEUE_SIZE,
+                 max_batch=SCHEDULER_MAX_BATCH, priority_size=SCHEDULER_PRIORITY_QUEUE_SIZE):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.device = device  # AsyncDevice
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+        self.max_batch = max_batch
+        self.priority_size = priority_size
+
+        self._clients = collections.OrderedDict()  # client -> ClientQueue, in round-robin order
+        self._priority = collections.deque()  # (future, command, unpack, ClientQueue), bounded per client
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def register(self, client, name=None):
+        with self._condition:
+            self._clients[client] = ClientQueue(name or str(client), self.burst)
+
+    def unregister(self, client):
+        """Forget a client, cancelling its queued commands. Returns its counters."""
+        with self._condition:
+            queue = self._clients.pop(client, None)
+        if queue is None:
+            return None
+        for future, _, _ in queue.commands:
+            future.cancel()
+        return queue.counters
+
+    def counters(self):
+        """Counters of all clients by name."""
+        with self._condition:
+            return {queue.name: dict(queue.counters) for queue in self._clients.values()}
+
+    def submit(self, client, command, unpack=False):
+        """Queue a command string of a registered client, or a list of them to run as one batch,
+        see Device.transceive_batch. Returns a Future of the response(s)."""
+        batch = isinstance(command, list)
+        with self._condition:
+            queue = self._clients[client]
+            queue.counters['submitted'] += len(command) if batch else 1
+            if not batch:
+                future = (self._put_priority if is_priority(command) else self._put)(queue, command, unpack)
+            elif len(command) > self.max_batch:
+                queue.counters['rejected'] += len(command)
+                future = Future()
+                future.set_exception(ValueError("Batch of {} commands exceeds {}".format(len(command), self.max_batch)))
+            else:
+                priority = [index for index, item in enumerate(command) if is_priority(item)]
+                if len(priority) in (0, len(command)):
+                    future = (self._put_priority if priority else self._put)(queue, command, unpack)
+                else:
+                    # only the commands turning the output off skip the queue
+                    rest = sorted(set(range(len(command))) - set(priority))
+                    parts = [(put(queue, [command[index] for index in indices], unpack), indices)
+                             for put, indices in ((self._put_priority, priority), (self._put, rest))]
+                    future = Future()
+                    join_batch(future, parts)
+            self._condition.notify()
+        return future
+
+    def _put(self, queue, command, unpack):
+        """Queue a job of a client. Requires the condition."""
+        future = Future()
+        if len(queue.commands) >= self.queue_size:
+            queue.counters['rejected'] += len(command) if isinstance(command, list) else 1
+            future.set_exception(SchedulerFull("Too many commands queued for {}".format(queue.name)))
+            return future
+        self._refill(queue, clock())
+        if queue.tokens < len(queue.commands) + 1:
+            # has to wait for a token
+            queue.counters['throttled'] += 1
+        queue.commands.append((future, command, unpack))
+        return future
+
+    def _put_priority(self, queue, command, unpack):
+        """Queue a job of a client turning the output off, ahead of all others. Requires the
+        condition."""
+        future = Future()
+        num_commands = len(command) if isinstance(command, list) else 1
+        if queue.num_priority >= self.priority_size:
+            queue.counters['rejected'] += num_commands
+            future.set_exception(SchedulerFull("Too many priority commands queued for {}".format(queue.name)))
+            return future
+        queue.counters['priority'] += num_commands
+        queue.num_priority += 1
+        self._priority.append((future, command, unpack, queue))
+        return future
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='CommandScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refill(self, queue, now):
+        queue.tokens = min(self.burst, queue.tokens + (now - queue.updated) * self.rate)
+        queue.updated = now
+
+    def _next(self):
+        """Next command to run as (future, command, unpack, ClientQueue), or None and the time
+        until a client has a token again. Requires the condition."""
+        if self._priority:
+            job = self._priority.popleft()
+            job[3].num_priority -= 1
+            return job, None
+        now = clock()
+        wait = None
+        for client, queue in self._clients.items():
+            if not queue.commands:
+                continue
+            self._refill(queue, now)
+            if queue.tokens >= 1:
+                # served clients go to the back of the line
+                del self._clients[client]
+                self._clients[client] = queue
+                future, command, unpack = queue.commands.popleft()
+                # batches may overdraw the bucket
+                queue.tokens -= len(command) if isinstance(command, list) else 1
+                return (future, command, unpack, queue), None
+            until = (1 - queue.tokens) / self.rate
+            wait = until if wait is None else min(wait, until)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    job, wait = self._next()
+                    if job is not None:
+                        break
+                    self._condition.wait(wait)
+                if not self._running:
+                    return
+            future, command, unpack, queue = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if isinstance(command, list):
+                    result = self.device.transceive_batch(command, unpack).result()
+                else:
+                    result = self.device.transceive(command, unpack).result()
+            except Exception as error:
+                queue.counters['failed'] += len(command) if isinstance(command, list) else 1
+                future.set_exception(error)
+            else:
+                if isinstance(command, list):
+                    failed = sum(isinstance(response, Exception) for response in result)
+                    queue.counters['failed'] += failed
+                    queue.counters['completed'] += len(result) - failed
+                else:
+                    queue.counters['completed'] += 1
+                future.set_result(result)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Current register values in a memory mapped file, for readers on the same host.
+
+The block has a fixed layout: a header of magic, version, number of slots, a sequence
+counter and the time of the last update, followed by one slot per register of (channel,
+op code, value, timestamp). The writer increments the counter before and after each
+update, so it is odd while an update is in progress (a seqlock). Readers copy the block
+and retry if the counter was odd or changed meanwhile, taking consistent snapshots without
+locks and without the writer ever waiting for them. Values never acquired are NaN with a
+timestamp of 0.
+
+A writer that died mid update leaves the counter odd, readers then give up after a timeout.
+A writer that stopped or was restarted removes or replaces the file, see StateReader.age
+and StateReader.replaced to detect it.
+"""
+
+import os
+import time
+import mmap
+import struct
+import tempfile
+import threading
+from .constants import *
+from .util import Reading, clock
+
+STATE_MAGIC = b'FL593SHM'
+STATE_VERSION = 2
+STATE_HEADER = struct.Struct('<8sIIQd')  # magic, version, number of slots, sequence counter, last update
+STATE_SEQ = struct.Struct('<Q')
+STATE_SEQ_OFFSET = 16
+STATE_UPDATED = struct.Struct('<d')  # wall time of the last update
+STATE_UPDATED_OFFSET = 24
+STATE_SLOT = struct.Struct('<BB6xdd')  # channel, op code, value, timestamp
+STATE_VALUE = struct.Struct('<dd')
+STATE_VALUE_OFFSET = 8  # of value and timestamp within a slot
+
+
+def default_path():
+    """Path of the state block, in /dev/shm where available."""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, SHARED_STATE_FILE)
+
+
+class SharedState(object):
+    """Writes the values of READ response packets of the registers to the state block."""
+    def __init__(self, path=None, registers=TELEMETRY_REGISTERS):
+        self.path = path or default_path()
+        self.registers = list(registers)
+        self.size = STATE_HEADER.size + len(self.registers) * STATE_SLOT.size
+        # byte offset of value and timestamp of each register
+        self.offsets = {register: STATE_HEADER.size + n * STATE_SLOT.size + STATE_VALUE_OFFSET
+                        for n, register in enumerate(self.registers)}
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._map = None
+
+    def start(self):
+        if self._map is not None:
+            return
+        block = STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(self.registers), 0, 0.) + b''.join(
+            STATE_SLOT.pack(channel, op_code, float('nan'), 0.) for channel, op_code in self.registers)
+        # written to a new file and renamed, readers never see a partial block
+        temp_path = '{}.{}'.format(self.path, os.getpid())
+        with open(temp_path, 'wb') as state_file:
+            state_file.write(block)
+        os.rename(temp_path, self.path)
+        with open(self.path, 'r+b') as state_file:
+            self._map = mmap.mmap(state_file.fileno(), self.size)
+        self.seq = 0
+
+    def stop(self):
+        if self._map is None:
+            return
+        with self._lock:
+            self._map.close()
+            self._map = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def push(self, packets):
+        """Update the slots of the registers of READ response packets in one write."""
+        updates = [(self.offsets[packet.channel, packet.op_code], packet.value, packet.timestamp)
+                   for packet in packets
+                   if packet.op_type == TYPE_READ and packet.value is not None
+                   and (packet.channel, packet.op_code) in self.offsets]
+        if not updates:
+            return
+        with self._lock:
+            block = self._map
+            if block is None:
+                return
+            self.seq += 1
+            STATE_SEQ.pack_into(block, STATE_SEQ_OFFSET, self.seq)
+            STATE_UPDATED.pack_into(block, STATE_UPDATED_OFFSET, time.time())
+            for offset, value, timestamp in updates:
+                STATE_VALUE.pack_into(block, offset, value, timestamp)
+            self.seq += 1
+            STATE_SEQ.pack_into(block, STATE_SEQ_OFFSET, self.seq)
+
+
+class StateReader(object):
+    """Lock free reader of a state block written by SharedState. Reads raise IOError if the
+    block stays locked by the writer for longer than [timeout] seconds."""
+    def __init__(self, path=None, timeout=SHARED_STATE_READ_TIMEOUT):
+        self.path = path or default_path()
+        self.timeout = timeout
+        with open(self.path, 'rb') as state_file:
+            self._map = mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._inode = os.fstat(state_file.fileno()).st_ino
+        magic, version, num_slots, _, _ = STATE_HEADER.unpack_from(self._map)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError("Not a state block: {}".format(self.path))
+        self.size = STATE_HEADER.size + num_slots * STATE_SLOT.size
+        self.registers = [STATE_SLOT.unpack_from(self._map, STATE_HEADER.size + n * STATE_SLOT.size)[:2]
+                          for n in range(num_slots)]
+        self.offsets = {register: STATE_HEADER.size + n * STATE_SLOT.size + STATE_VALUE_OFFSET
+                        for n, register in enumerate(self.registers)}
+
+    def _copy(self, start, end):
+        """Consistent copy of a range of the block."""
+        block = self._map
+        deadline = None
+        while True:
+            seq = STATE_SEQ.unpack_from(block, STATE_SEQ_OFFSET)[0]
+            if not seq & 1:
+                data = block[start:end]
+                if STATE_SEQ.unpack_from(block, STATE_SEQ_OFFSET)[0] == seq:
+                    return seq, data
+            # the clock is only read once contended
+            if deadline is None:
+                deadline = clock() + self.timeout
+            elif clock() > deadline:
+                raise IOError("State block {} locked, the writer stopped mid update".format(self.path))
+            time.sleep(0)
+
+    def read(self, channel, op_code):
+        """Reading of the value and timestamp of a register."""
+        offset = self.offsets[channel, op_code]
+        _, data = self._copy(offset, offset + STATE_VALUE.size)
+        return Reading(*STATE_VALUE.unpack(data))
+
+    def snapshot(self):
+        """Sequence counter and Readings of all registers, as of the same update."""
+        seq, data = self._copy(0, self.size)
+        return seq, {register: Reading(*STATE_VALUE.unpack_from(data, offset))
+                     for register, offset in self.offsets.items()}
+
+    def age(self):
+        """Seconds since the writer last updated the block, None if it never did."""
+        _, data = self._copy(STATE_UPDATED_OFFSET, STATE_UPDATED_OFFSET + STATE_UPDATED.size)
+        updated, = STATE_UPDATED.unpack(data)
+        return time.time() - updated if updated else None
+
+    def replaced(self):
+        """Whether the writer stopped, or was restarted with a new block, since the reader opened
+        the block. The values of this reader no longer change then, open a new one."""
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return True
+
+    def close(self):
+        self._map.close()
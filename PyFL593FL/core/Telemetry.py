@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+History of polled register values in fixed capacity NumPy ring buffers.
+
+Each sample is written twice, at position i and i + capacity of a buffer of twice the
+capacity. The most recent samples are thus always contiguous, and readers get views
+of the last N samples or of a time window without copying. Views are overwritten by
+later samples once the ring wraps around, copy them to keep them.
+
+Values are stored in device units, as in Packet.value.
+"""
+
+import threading
+from .constants import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RingBuffer(object):
+    """Fixed capacity ring of time stamped samples."""
+    def __init__(self, capacity, dtype):
+        if np is None:
+            raise ImportError('NumPy not found.')
+        self.capacity = capacity
+        self.timestamps = np.zeros(2 * capacity, dtype=np.float64)
+        self.values = np.zeros(2 * capacity, dtype=dtype)
+        self.count = 0  # total number of samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, value):
+        position = self.count % self.capacity
+        self.timestamps[position] = self.timestamps[position + self.capacity] = timestamp
+        self.values[position] = self.values[position + self.capacity] = value
+        self.count += 1
+
+    def last(self, num_samples=None):
+        """Views of the timestamps and values of the last [num_samples] samples, oldest first."""
+        available = len(self)
+        num_samples = available if num_samples is None else min(num_samples, available)
+        end = self.count % self.capacity + self.capacity
+        return self.timestamps[end - num_samples:end], self.values[end - num_samples:end]
+
+    def window(self, t_start, t_end=None):
+        """Views of the timestamps and values of the samples taken between [t_start] and [t_end]."""
+        timestamps, values = self.last()
+        start = np.searchsorted(timestamps, t_start, side='left')
+        end = len(timestamps) if t_end is None else np.searchsorted(timestamps, t_end, side='right')
+        return timestamps[start:end], values[start:end]
+
+
+class Telemetry(object):
+    """Ring buffers of the register values of all channels, fed by the acquisition path."""
+    def __init__(self, capacity=TELEMETRY_CAPACITY, registers=TELEMETRY_REGISTERS):
+        if np is None:
+            raise ImportError('NumPy not found.')
+        self.lock = threading.Lock()
+        self.series = {(channel, op_code): RingBuffer(capacity, np.uint16 if op_code == CMD_ALARM else np.float32)
+                       for channel, op_code in registers}
+
+    def push(self, packets):
+        """Append the values of READ response packets of recorded registers."""
+        series = self.series
+        with self.lock:
+            for packet in packets:
+                ring = series.get((packet.channel, packet.op_code))
+                if ring is not None and packet.op_type == TYPE_READ and packet.value is not None:
+                    ring.append(packet.timestamp, packet.value)
+
+    def last(self, channel, op_code, num_samples=None):
+        """Views of the timestamps and values of the last [num_samples] samples of a register."""
+        return self.series[channel, op_code].last(num_samples)
+
+    def window(self, channel, op_code, t_start, t_end=None):
+        """Views of the timestamps and values of a register between [t_start] and [t_end]."""
+        return self.series[channel, op_code].window(t_start, t_end)
@@ -61,7 +61,7 @@ CHANNEL_DICT = {
     'LD1': CHAN_LD1,
     'LD2': CHAN_LD2,
 }
-CHANNEL_DICT_REV = {v: k for k, v in CHANNEL_DICT.iteritems()}
+CHANNEL_DICT_REV = {v: k for k, v in CHANNEL_DICT.items()}
 
 # OpTypes
 TYPE_READ = 0x01  # return OpCode quantity to host
@@ -74,7 +74,7 @@ OP_TYPE_DICT = {
     "MIN": TYPE_MIN,
     "MAX": TYPE_MAX,
 }
-OP_TYPE_DICT_REV = {v: k for k, v in OP_TYPE_DICT.iteritems()}
+OP_TYPE_DICT_REV = {v: k for k, v in OP_TYPE_DICT.items()}
 
 # General OpCodes
 # r = read, w = write
@@ -156,7 +156,93 @@ EXPIRY_DICT = {
     CMD_RPD: EXPIRY_SLOW,
     CMD_CAL_ISCALE: EXPIRY_SLOW,
 }
-OP_CODE_DICT_REV = {v: k for k, v in OP_CODE_DICT.iteritems()}
+# Background polling, see Polling.py
+POLL_MIN_INTERVAL = EXPIRY_FAST  # registers that always expire are polled at this interval
+POLL_EXPIRY_FACTOR = 2.0  # polled registers expire after this many polling intervals
+POLL_ERROR_BACKOFF = TIMEOUT / 1000.  # pause after failed polls
+
+# Telemetry history, see Telemetry.py
+TELEMETRY_CAPACITY = 2 ** 16  # samples kept per register
+TELEMETRY_REGISTERS = [(CHAN_STATUS, CMD_ALARM)] + [(channel, op_code)
+                                                    for channel in (CHAN_LD1, CHAN_LD2)
+                                                    for op_code in (CMD_IMON, CMD_PMON, CMD_SETPOINT, CMD_LIMIT)]
+
+# Recording, see Recording.py
+RECORDING_QUEUE_SIZE = 1024  # packet batches waiting to be written before dropping
+RECORDING_CHUNK_SIZE = 256  # packet batches written at once
+RECORDING_FLUSH_INTERVAL = 0.5  # seconds, maximum delay before queued samples are written
+RECORDING_STOP_TIMEOUT = 5.0  # seconds stop() waits for the writer to finish
+RECORDING_SEGMENT_SIZE = 2**16  # records per indexed segment
+RECORDING_PYRAMID_FACTOR = 10  # buckets of a level merged into one of the next
+RECORDING_PYRAMID_LEVELS = 6
+
+# Command scheduling for shared access, e.g. by web clients, see Scheduling.py
+SCHEDULER_RATE = 50.  # commands per second per client
+SCHEDULER_BURST = 20  # commands a client may send at once after being idle
+SCHEDULER_QUEUE_SIZE = 64  # commands or batches queued per client before rejecting
+SCHEDULER_MAX_BATCH = 256  # commands per batch, a batch costs a token per command
+# Writing 0 to these turns the output off. Such commands go first and are never rate limited
+SCHEDULER_PRIORITY_OP_CODES = (CMD_ENABLE, CMD_SETPOINT, CMD_LIMIT)
+SCHEDULER_PRIORITY_QUEUE_SIZE = 4  # commands or batches turning the output off queued per client
+
+# Device server sharing a device between processes, see DeviceServer.py. Either the path of
+# a Unix socket, or host:port for TCP
+DEVICE_SERVER_ADDRESS = '/tmp/fl593fl.sock'
+DEVICE_SERVER_PIPELINE = 256  # requests sent by a client before reading their responses
+
+# Live telemetry stream for other processes, see Publishing.py. Unix socket path or host:port
+PUBLISH_ADDRESS = '/tmp/fl593fl-telemetry.sock'
+PUBLISH_QUEUE_SIZE = 1024  # packet batches waiting to be published before dropping
+
+# Shared memory state block for same-host readers, see SharedState.py. Placed in /dev/shm
+# where available, else in the temp directory
+SHARED_STATE_FILE = 'fl593fl-state'
+SHARED_STATE_READ_TIMEOUT = 0.1  # seconds a reader waits for an update in progress
+
+# asyncio facade, see Asynchronous.py
+UPDATES_QUEUE_SIZE = 64  # packet lists an update iterator buffers before dropping the oldest
+
+# Stale-while-revalidate: how long past its expiry a cached value may still be returned
+# immediately while a refresh runs in the background. Opt-in, see Channel.revalidate
+STALE_NONE = 0.0
+STALE_SHORT = 0.1
+STALE_LONG = 1.0
+STALE_DICT = {
+    CMD_MODEL: STALE_NONE,
+    CMD_SERIAL: STALE_NONE,
+    CMD_FWVER: STALE_NONE,
+    CMD_DEVTYPE: STALE_NONE,
+    CMD_CHANCT: STALE_LONG,
+    CMD_IDENTIFY: STALE_NONE,
+    CMD_SAVE: STALE_NONE,
+    CMD_PASSWD: STALE_NONE,
+    CMD_REVERT: STALE_NONE,
+    CMD_RECALL: STALE_NONE,
+    CMD_ALARM: STALE_SHORT,  # safety relevant, keep short
+    CMD_SETPOINT: STALE_LONG,
+    CMD_LIMIT: STALE_LONG,
+    CMD_MODE: STALE_LONG,
+    CMD_TRACK: STALE_LONG,
+    CMD_IMON: STALE_SHORT,
+    CMD_PMON: STALE_SHORT,
+    CMD_ENABLE: STALE_SHORT,
+    CMD_RPD: STALE_LONG,
+    CMD_CAL_ISCALE: STALE_LONG,
+}
+# Registers whose cached READ value is updated from the echo in the response to a WRITE
+WRITE_THROUGH = frozenset([CMD_SERIAL, CMD_SETPOINT, CMD_LIMIT, CMD_MODE, CMD_TRACK, CMD_ENABLE,
+                           CMD_RPD, CMD_CAL_ISCALE])
+# Registers of the same channel whose cached values become invalid when writing a register
+INVALIDATE_DICT = {
+    CMD_ENABLE: (CMD_ALARM,),  # REN and OUT flags
+    CMD_MODE: (CMD_ALARM,),  # MODE flags
+    CMD_TRACK: (CMD_ALARM, CMD_CHANCT),  # PARA flag, number of channels
+    CMD_PASSWD: (CMD_ALARM,),  # CALMODE flag
+    CMD_REVERT: (CMD_ALARM,),  # CALMODE flag
+    CMD_SAVE: (CMD_ALARM,),  # WRITE flag
+    CMD_IDENTIFY: (CMD_ALARM,),  # IDENT flag
+}
+OP_CODE_DICT_REV = {v: k for k, v in OP_CODE_DICT.items()}
 
 # ALARM FLAGS
 NUM_ALARMS = 10
@@ -182,7 +268,7 @@ ALARM_FLAG_DICT = {
     'WRITE':  ALARM_WRITE,  # write to non-volatile memory in progress following SAVE
     'CALMODE': ALARM_CALMODE,  # 1: device is in calibration mode, entered with PASSWD and left with REVERT
     }
-ALARM_FLAG_DICT_REV = {v: k for k, v in ALARM_FLAG_DICT.iteritems()}
+ALARM_FLAG_DICT_REV = {v: k for k, v in ALARM_FLAG_DICT.items()}
 
 # FLAGS (instead of taking non-zero values as true, uses literal ASCII characters)
 # I assume all input gets fed through atoi, sscan or similar?
@@ -212,7 +298,7 @@ END_CODE_DICT = {
     ERR_SAFETY: "SAFETY",
     ERR_CALMODE: "CALMODE"
 }
-END_CODE_DICT_REV = {v: k for k, v in END_CODE_DICT.iteritems()}
+END_CODE_DICT_REV = {v: k for k, v in END_CODE_DICT.items()}
 END_CODE_DESC_DICT = {
     ERR_OK: "No Error",
     ERR_DEVTYPE: "Incorrect device type",
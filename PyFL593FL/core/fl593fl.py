@@ -7,21 +7,29 @@ Created on 05 Apr 2014 3:27 AM
 FL593FL evaluation board USB interface class
 """
 
-import sys
 import logging
 from collections import namedtuple
-import Devices
-from Channels import StatusChannel, LaserChannel
-
-if sys.hexversion > 0x03000000:
-    raise EnvironmentError('Python 3 not supported.')
+from . import Devices
+from .constants import TYPE_READ, ERR_OK, TELEMETRY_CAPACITY, PUBLISH_ADDRESS
+from .Channels import StatusChannel, LaserChannel
+from .Polling import Poller
+from .Telemetry import Telemetry
+from .Recording import Recorder
+from .Publishing import Publisher
+from .SharedState import SharedState
 
 
 class FL593FL(object):
-    def __init__(self, device_class=Devices.USB, config=1):
+    def __init__(self, device_class=Devices.USB, config=1, revalidate=False):
         self.log = logging.getLogger(self.__class__.__name__)
         self.channels = None
         self.status = None
+        self.poller = None
+        self.telemetry = None
+        self.recorder = None
+        self.publisher = None
+        self.shared_state = None
+        self.sinks = []  # callables receiving every list of freshly acquired packets
 
         try:
             device = device_class(config)
@@ -40,6 +48,8 @@ class FL593FL(object):
         channels = namedtuple('channels', 'status, ld1, ld2')
         self.channels = channels(StatusChannel(0), LaserChannel(1), LaserChannel(2))
         self.status = self.channels.status
+        for channel in self.channels:
+            channel.revalidate = revalidate
         self.initialize()
         self.update()
         self.log.debug('Device proxy channels initialized and ready to go.')
@@ -50,8 +60,111 @@ class FL593FL(object):
 
     def update(self):
         """Ask the channels to ask the device to grab the respective current states."""
-        for channel in self.channels:
-            channel.update()
+        self.snapshot()
+
+    def snapshot(self, max_age=None):
+        """Read the update registers of all channels that are not fresh enough in one device batch.
+
+        Returns a dict of channel id: {op code: packet}. Raises after storing the successful
+        responses of all channels if any response failed."""
+        expired = [(channel, channel.expired([channel.registers.index(TYPE_READ, op_code)
+                                              for op_code in channel.UPDATE_REGISTERS], max_age))
+                   for channel in self.channels]
+        frames = [channel.registers.frames[index] for channel, indices in expired for index in indices]
+        responses = self.device.transceive_many(frames) if frames else []
+        start = 0
+        errors = []
+        for channel, indices in expired:
+            try:
+                channel.store_many(indices, responses[start:start + len(indices)])
+            except ValueError as error:
+                errors.append('{}: {}'.format(channel.id, error))
+            start += len(indices)
+        if responses:
+            self.publish([response for response in responses if response.end_code == ERR_OK])
+        if errors:
+            raise ValueError('; '.join(errors))
+        return {channel.id: {op_code: channel.registers.packets[channel.registers.index(TYPE_READ, op_code)]
+                             for op_code in channel.UPDATE_REGISTERS}
+                for channel in self.channels}
+
+    def publish(self, packets):
+        """Hand freshly acquired packets to all sinks, e.g. the telemetry history."""
+        for sink in self.sinks:
+            sink(packets)
+
+    def enable_telemetry(self, capacity=TELEMETRY_CAPACITY):
+        """Keep a history of the acquired register values, see Telemetry."""
+        if self.telemetry is None:
+            self.telemetry = Telemetry(capacity)
+            self.sinks.append(self.telemetry.push)
+        return self.telemetry
+
+    def start_recording(self, path):
+        """Record the acquired register values to the session directory [path], see Recorder."""
+        if self.recorder is None:
+            self.recorder = Recorder(path)
+            self.recorder.start()
+            self.sinks.append(self.recorder.push)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.sinks.remove(self.recorder.push)
+            self.recorder.stop()
+            self.recorder = None
+
+    def start_publishing(self, location=PUBLISH_ADDRESS, transport=None):
+        """Publish the acquired register values to other processes, see Publisher."""
+        if self.publisher is None:
+            self.publisher = Publisher(location, transport=transport)
+            self.publisher.start()
+            self.sinks.append(self.publisher.push)
+        return self.publisher
+
+    def stop_publishing(self):
+        if self.publisher is not None:
+            self.sinks.remove(self.publisher.push)
+            self.publisher.stop()
+            self.publisher = None
+
+    def start_sharing(self, path=None):
+        """Mirror the acquired register values into a shared memory block, see SharedState."""
+        if self.shared_state is None:
+            self.shared_state = SharedState(path)
+            self.shared_state.start()
+            # values acquired so far, later ones arrive through the sinks
+            packets = []
+            for channel in self.channels:
+                registers = channel.registers
+                for op_code in channel.UPDATE_REGISTERS:
+                    packet = registers.packets[registers.index(TYPE_READ, op_code)]
+                    if packet is not None:
+                        packets.append(packet)
+            self.shared_state.push(packets)
+            self.sinks.append(self.shared_state.push)
+        return self.shared_state
+
+    def stop_sharing(self):
+        if self.shared_state is not None:
+            self.sinks.remove(self.shared_state.push)
+            self.shared_state.stop()
+            self.shared_state = None
+
+    def start_polling(self, subscribe_all=True):
+        """Poll the device in a background thread, keeping the register mirrors up to date.
+        By default all update registers are polled, see Poller.subscribe for others."""
+        if self.poller is None:
+            self.poller = Poller(self)
+            if subscribe_all:
+                self.poller.subscribe_all()
+            self.poller.start()
+        return self.poller
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
 
     def reset(self):
         """Reset whole device.
@@ -63,6 +176,10 @@ class FL593FL(object):
         self.device.reset()
 
     def close(self):
+        self.stop_polling()
+        self.stop_recording()
+        self.stop_publishing()
+        self.stop_sharing()
         for channel in self.channels:
             channel.close()
         self.device.close()
@@ -82,8 +199,8 @@ if __name__ == '__main__':
 
     dev = FL593FL(device_class=Devices.Dummy if cli_args.DUMMY else Devices.USB)
     if dev is not None and dev.channels.status is not None:
-        print 'Device:', dev.channels.status.get_device_type()
-        print 'Model:', dev.channels.status.get_model()
-        print 'Firmware:', dev.channels.status.get_fw_version()
+        print('Device:', dev.channels.status.get_device_type().value)
+        print('Model:', dev.channels.status.get_model().value)
+        print('Firmware:', dev.channels.status.get_fw_version().value)
         dev.channels.status.show_alarms()
         dev.close()
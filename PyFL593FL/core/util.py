@@ -17,13 +17,69 @@
 # set remote enable: "STATUS WRITE ENABLE 0", or disable: "STATUS WRITE ENABLE 0"
 # read current applied to diode 1: "LD1 READ IMON"
 
+import sys
 import time
-import array
-from constants import *
+import socket
+import struct
+import queue
+import logging
+import threading
+from .constants import *
 from collections import namedtuple
 import random
 
-Packet = namedtuple("packet", "channel, op_type, op_code, end_code, data, string")
+# Decoded command or response. data is the raw data field as bytes, value its parsed value
+Packet = namedtuple("packet", "channel, op_type, op_code, end_code, data, value, timestamp, string")
+
+# Value of a field together with the time it was acquired from the device
+Reading = namedtuple("reading", "value, timestamp")
+
+# Clock for ages and expiry. Timestamps of packets are wall clock time.
+clock = time.monotonic
+
+
+def parse_flags(data):
+    """ASCII flag field (e.g. ALARM) into an int bitmask, flag n in bit n."""
+    return int(data[::-1], 2)
+
+
+def parse_text(data):
+    """ASCII text field (e.g. MODEL) into a str."""
+    return data.decode('ascii', 'replace')
+
+# Parsers turning the data field of a response into a typed value, per op code.
+# Applied once when decoding, so all consumers of a (cached) packet share the result.
+# Data fields are bytes, int() and float() parse them without decoding to text first.
+RESPONSE_PARSERS = {
+    CMD_MODEL: parse_text,
+    CMD_SERIAL: parse_text,
+    CMD_FWVER: parse_text,
+    CMD_DEVTYPE: parse_text,
+    CMD_CHANCT: int,
+    CMD_IDENTIFY: int,
+    CMD_SAVE: parse_text,
+    CMD_PASSWD: parse_text,
+    CMD_REVERT: parse_text,
+    CMD_RECALL: parse_text,
+    CMD_ALARM: parse_flags,
+    CMD_SETPOINT: float,
+    CMD_LIMIT: float,
+    CMD_MODE: int,
+    CMD_TRACK: int,
+    CMD_IMON: float,
+    CMD_PMON: float,
+    CMD_ENABLE: int,
+    CMD_RPD: float,
+    CMD_CAL_ISCALE: float,
+}
+
+
+def parse_data(op_code, data):
+    """Typed value of a response data field, None if it can't be parsed."""
+    try:
+        return RESPONSE_PARSERS[op_code](data)
+    except (KeyError, ValueError):
+        return None
 
 
 def unpack_string(string):
@@ -40,47 +96,221 @@ def unpack_string(string):
             end_code = END_CODE_DICT_REV[words.pop()]
         else:
             end_code = None
-        data = ' '.join(reversed(words))  # rest is data, which may contain spaces?
+        data = ' '.join(reversed(words)).rstrip('\0').encode('ascii')  # rest is data, which may contain spaces?
+        value = parse_data(op_code, data) if end_code == ERR_OK else None
         return Packet(channel=channel, op_type=op_type,  op_code=op_code,
-                      end_code=end_code, data=data.rstrip('\0'), string=string)
+                      end_code=end_code, data=data, value=value, timestamp=None, string=string)
     except IndexError:
         raise ValueError("Incomplete packet: {}".format(string))
 
 
+# Precomputed lookup tables for the binary codec. Names are indexed directly by the raw
+# byte value of the respective field, headers by the (channel, op_type, op_code) triple.
+_CHANNEL_NAMES = tuple(CHANNEL_DICT_REV.get(n) for n in range(256))
+_OP_TYPE_NAMES = tuple(OP_TYPE_DICT_REV.get(n) for n in range(256))
+_OP_CODE_NAMES = tuple(OP_CODE_DICT_REV.get(n) for n in range(256))
+_END_CODE_NAMES = tuple(END_CODE_DICT.get(n) for n in range(256))
+_HEADERS = {(channel, op_type, op_code): bytes((DEV_TYPE, channel, op_type, op_code))
+            for channel in CHANNEL_DICT.values()
+            for op_type in OP_TYPE_DICT.values()
+            for op_code in OP_CODE_DICT.values()}
+_PADDING = b'\0' * LEN_DATA
+LEN_HEADER_OUT = EP_PACK_OUT - LEN_DATA  # DevType, Channel, OpType, OpCode
+LEN_HEADER_IN = EP_PACK_IN - LEN_DATA  # DevType, Channel, OpType, OpCode, EndCode
+
+
+def encode_packet(channel, op_type, op_code, data=b''):
+    """Encode numeric command fields and the data bytes directly into a 20 byte frame that
+    can be transmitted to a USB device, without going through the command string.
+    """
+    try:
+        header = _HEADERS[channel, op_type, op_code]
+    except KeyError:
+        raise ValueError("Invalid command: {}, {}, {}".format(channel, op_type, op_code))
+    if len(data) > LEN_DATA:
+        raise ValueError("Data field too long: {}".format(data))
+    return header + data + _PADDING[len(data):]
+
+
+# Frames of all commands that carry no data (READ, MIN, MAX) for every channel and op code,
+# encoded once at import and shared by all users: FIXED_FRAMES[op_type][channel][op_code].
+# The frames are sent as they are, never modify them!
+FIXED_FRAMES = {op_type: {channel: {op_code: encode_packet(channel, op_type, op_code)
+                                    for op_code in OP_CODE_DICT.values()}
+                          for channel in CHANNEL_DICT.values()}
+                for op_type in (TYPE_READ, TYPE_MIN, TYPE_MAX)}
+
+
+def decode_packet(response):
+    """Decode a 21 byte response frame from a USB device into a Packet without assembling
+    the response string. The string field is left empty, see format_packet for that.
+    The frame can be any bytes-like object, e.g. a memoryview into a receive buffer.
+    """
+    if len(response) < LEN_HEADER_IN:
+        raise ValueError("Incomplete packet: {}".format(response))
+    op_code = response[3]
+    end_code = response[4]
+    data = bytes(response[LEN_HEADER_IN:]).rstrip(b'\0').strip()
+    value = parse_data(op_code, data) if end_code == ERR_OK else None
+    return Packet(channel=response[1], op_type=response[2], op_code=op_code, end_code=end_code,
+                  data=data, value=value, timestamp=time.time(), string=None)
+
+
+def format_packet(packet):
+    """Readable string of a command or response packet, e.g. for debugging and the REPL."""
+    words = [_CHANNEL_NAMES[packet.channel], _OP_TYPE_NAMES[packet.op_type], _OP_CODE_NAMES[packet.op_code]]
+    if packet.end_code is not None:
+        words.append(_END_CODE_NAMES[packet.end_code])
+    if None in words:
+        raise ValueError("Unknown field in packet: {}".format(packet))
+    if packet.data:
+        words.append(packet.data.decode('ascii', 'replace'))
+    return ' '.join(words)
+
+
 def encode_command(command):
-    """Encodes a command in string form (e.g. "STATUS WRITE ENABLE 0") into a byte
-    array that can be transmitted to a USB device.
+    """Encodes a command in string form (e.g. "STATUS WRITE ENABLE 0") into a
+    frame that can be transmitted to a USB device.
     """
     pkt = unpack_string(command)
-    code_list = [DEV_TYPE, pkt.channel, pkt.op_type, pkt.op_code]
-    # data
-    code_list.extend(map(ord, pkt.data))
-    if len(code_list) < EP_PACK_OUT:
-        code_list.extend([0x00] * (EP_PACK_OUT-len(code_list)))
-    encoded = array.array('B')
-    encoded.fromlist(code_list)
-    return encoded
+    return encode_packet(pkt.channel, pkt.op_type, pkt.op_code, pkt.data)
 
 
 def decode_command(command):
-    print command
-    raise NotImplementedError
+    """Decode a 20 byte command frame into a Packet. Counterpart of encode_packet, used
+    by devices that have to answer commands themselves, e.g. the Dummy.
+    """
+    if len(command) < LEN_HEADER_OUT:
+        raise ValueError("Incomplete packet: {}".format(command))
+    return Packet(channel=command[1], op_type=command[2], op_code=command[3], end_code=None,
+                  data=bytes(command[LEN_HEADER_OUT:]).rstrip(b'\0'), value=None, timestamp=None,
+                  string=None)
 
 
 def encode_response(response):
-    print response
-    raise NotImplementedError
+    """Encode a response Packet into a 21 byte frame as it would be returned by a USB device."""
+    data = response.data
+    if len(data) > LEN_DATA:
+        raise ValueError("Data field too long: {}".format(data))
+    header = _HEADERS[response.channel, response.op_type, response.op_code] + bytes((response.end_code,))
+    return header + data + _PADDING[len(data):]
 
 
 def decode_response(response):
-    """Assemble a readable string from a byte array response from a USB device."""
-    channel = CHANNEL_DICT_REV[response[1]]
-    op_type = OP_TYPE_DICT_REV[response[2]]
-    op_code = OP_CODE_DICT_REV[response[3]]
-    end_code = END_CODE_DICT[response[4]]
-    data = response[5:]
-    response_string = ' '.join([channel, op_type, op_code, end_code, data.tostring().strip()])
-    return response_string
+    """Assemble a readable string from a response frame from a USB device."""
+    return format_packet(decode_packet(response))
+
+
+# Device server protocol, see DeviceServer.py. A request is a request id and a command frame,
+# a response the id, a status and the response frame. Errors of the device on the server end
+# are answered with DEVICE_SERVER_ERROR and an empty frame.
+REQUEST_HEADER = struct.Struct('<I')
+RESPONSE_HEADER = struct.Struct('<IB')
+REQUEST_SIZE = REQUEST_HEADER.size + EP_PACK_OUT
+RESPONSE_SIZE = RESPONSE_HEADER.size + EP_PACK_IN
+DEVICE_SERVER_OK = 0
+DEVICE_SERVER_ERROR = 1
+
+
+def parse_address(location):
+    """Socket family and address of a device server location, a Unix socket path or host:port."""
+    if '/' not in location and ':' in location:
+        host, port = location.rsplit(':', 1)
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, location
+
+
+class SingleFlight(object):
+    """Collapses concurrent calls for the same key into a single call. Callers arriving
+    while the call is in flight wait for it and share its result, or its exception."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+
+class _Flight(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Refresher(object):
+    """Runs refresh calls in a background thread. Calls for a key that is already
+    waiting to be refreshed are dropped."""
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='Refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, key, func, *args, **kwargs):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put((key, func, args, kwargs))
+
+    def _run(self):
+        while True:
+            key, func, args, kwargs = self._queue.get()
+            with self._lock:
+                self._pending.discard(key)
+            try:
+                func(*args, **kwargs)
+            except Exception as error:
+                self.log.debug("Refresh of {} failed: {}".format(key, error))
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher():
+    """Shared refresher, its thread is started on first use."""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Refresher()
+    return _refresher
+
+
+def effective_expiry(expiry, max_age=None, min_interval=None):
+    """Seconds a cached value stays fresh: the default [expiry], unless overridden by [max_age],
+    at least [min_interval]. Negative if it never expires."""
+    exp = expiry if max_age is None else max_age
+    if min_interval is not None and 0 <= exp < min_interval:
+        exp = min_interval
+    return exp
 
 
 def memoize_with_expiry(expiry_time=None, _cache=None, num_args=None):
@@ -88,47 +318,70 @@ def memoize_with_expiry(expiry_time=None, _cache=None, num_args=None):
 
     Cache can be external if provided via [_cache] or internal.
     Expiration time will be read from the FL593FL expiry time dictionary if not given. If negative,
-    cached values never expire (e.g. constant values like MODEL)"""
+    cached values never expire (e.g. constant values like MODEL)
+
+    Thread-safe: concurrent cache misses on the same key wait for a single call of the
+    decorated function and share its result. The age of a cached value is available via the
+    age() attribute of the decorated function.
+
+    Callers can override the expiry per call with the [max_age] keyword, and cap the rate of
+    calls to the decorated function with [min_interval], see effective_expiry. Neither is
+    passed on or part of the key."""
     # FIXME: Using keyword argument is separate key from positional argument call
     # to fix: read argument keywords from function and ALWAYS generate the frozen set by sorting them out
     def _decorating_wrapper(func):
-        def _caching_wrapper(*args, **kwargs):
-            # Determine what cache to use
-            if _cache is None and not hasattr(func, '_cache'):
-                func._cache = {}
-            cache = _cache or func._cache
+        # Determine what cache to use
+        if _cache is None:
+            func._cache = {}
+        cache = func._cache if _cache is None else _cache
+        flights = SingleFlight()
+
+        def _fetch(key, args, kwargs):
+            result = func(*args, **kwargs)
+            cache[key] = (result, time.time())
+            return result
 
+        def _key(args, kwargs):
             mem_args = args[:num_args]
             if kwargs:
-                key = mem_args, frozenset(kwargs.iteritems())
+                return mem_args, frozenset(kwargs.items())
             else:
-                key = mem_args
+                return mem_args
+
+        def _caching_wrapper(*args, **kwargs):
+            max_age = kwargs.pop('max_age', None)
+            min_interval = kwargs.pop('min_interval', None)
+            key = _key(args, kwargs)
             if key in cache:
                 result, timestamp = cache[key]
                 if expiry_time is None:
-                    exp = EXPIRY_DICT[kwargs['op_code'] if 'op_code' in kwargs else args[1]]
+                    default = EXPIRY_DICT[kwargs['op_code'] if 'op_code' in kwargs else args[1]]
                 else:
-                    exp = expiry_time
-                age = time.time() - timestamp
-                if exp < 0 or age < exp:
+                    default = expiry_time
+                exp = effective_expiry(default, max_age, min_interval)
+                if exp < 0 or time.time() - timestamp < exp:
                     return result
-            result = func(*args, **kwargs)
-            cache[key] = (result, time.time())
-            return result
+            return flights.do(key, _fetch, key, args, kwargs)
+
+        def _age(*args, **kwargs):
+            """Seconds since the cached value was acquired, None if not cached."""
+            entry = cache.get(_key(args, kwargs))
+            return None if entry is None else time.time() - entry[1]
+
+        _caching_wrapper.age = _age
         return _caching_wrapper
     return _decorating_wrapper
 
 
 @memoize_with_expiry(expiry_time=1.0)
 def fake_data(command, chance_to_fail=None, end_code=ERR_OK):
-    """Given a command, returns fake data that can be used to test without an actual device.
+    """Given a decoded command packet, returns a fake response frame that can be used to test
+    without an actual device.
 
     Can be made to occasionally fail, either with a fixed error, or a random error code."""
-    packet = unpack_string(command)
-
-    channel = packet.channel
-    op_type = packet.op_type
-    op_code = packet.op_code
+    channel = command.channel
+    op_type = command.op_type
+    op_code = command.op_code
     end_code = end_code
     if chance_to_fail is not None and random.random() > chance_to_fail:
         end_code = random.choice(END_CODE_DICT) if end_code is None else end_code
@@ -136,41 +389,54 @@ def fake_data(command, chance_to_fail=None, end_code=ERR_OK):
 
     if op_type == TYPE_READ:
         data_dict = {
-            CMD_MODEL: 'FL593-Dummy',
-            CMD_FWVER: '42.0.0',
-            CMD_CHANCT: '2',
-            CMD_IMON: "{:.1f}".format(random.random()*250),
-            CMD_PMON: "{:.1f}".format(random.random()*250),
-            CMD_LIMIT: "{:.1f}".format(random.random()*250),
-            CMD_SETPOINT: "{:.1f}".format(random.random()*250),
-            CMD_MODE: '1',
-            CMD_ALARM: "".join([chr(random.choice([FLAG_OFF, FLAG_ON])) for _ in range(8)])
+            CMD_MODEL: b'FL593-Dummy',
+            CMD_FWVER: b'42.0.0',
+            CMD_CHANCT: b'2',
+            CMD_IMON: b"%.1f" % (random.random()*250),
+            CMD_PMON: b"%.1f" % (random.random()*250),
+            CMD_LIMIT: b"%.1f" % (random.random()*250),
+            CMD_SETPOINT: b"%.1f" % (random.random()*250),
+            CMD_MODE: b'1',
+            CMD_ALARM: bytes(random.choice([FLAG_OFF, FLAG_ON]) for _ in range(8))
         }
         data = data_dict[op_code]
 
     elif op_type == TYPE_WRITE:
-        data = packet.data
+        data = command.data
     else:
         raise NotImplementedError("No fake data for op_type {}".format(op_type))
 
-    return ' '.join(map(str, [CHANNEL_DICT_REV[channel], OP_TYPE_DICT_REV[op_type],
-                              OP_CODE_DICT_REV[op_code], END_CODE_DICT[end_code], data]))
+    return encode_response(command._replace(end_code=end_code, data=data))
 
 
 if __name__ == "__main__":
     # TODO: Move into tests
     cmd = "STATUS READ MODEL"
     encoded_cmd = encode_command(cmd)
-    print cmd, ':'
-    print encoded_cmd, encoded_cmd.tostring().encode('hex')
-    print unpack_string(cmd)
+    print(cmd, ':')
+    print(encoded_cmd, encoded_cmd.hex())
+    print(unpack_string(cmd))
+    print(decode_command(encoded_cmd), format_packet(decode_command(encoded_cmd)))
     try:
         unpack_string("STATUS READ")  # incomplete command
     except ValueError as error:
-        print error
+        print(error)
     else:
         raise AssertionError("Should have been illegal string!")
 
+    # Per command allocations and time of encoding vs. looking up the precompiled frame
+    import timeit
+    import tracemalloc
+    num_calls = 100000
+    for name, fn in [('encode_packet', lambda: encode_packet(CHAN_LD1, TYPE_READ, CMD_IMON)),
+                     ('FIXED_FRAMES', lambda: FIXED_FRAMES[TYPE_READ][CHAN_LD1][CMD_IMON])]:
+        duration = timeit.timeit(fn, number=num_calls)
+        tracemalloc.start()
+        frames = [fn() for _ in range(1000)]
+        allocated = tracemalloc.get_traced_memory()[0] - sys.getsizeof(frames)
+        tracemalloc.stop()
+        print("{}: {:.2f} us/call, {:.0f} bytes/call".format(name, duration / num_calls * 1e6, allocated / 1000.))
+
     @memoize_with_expiry(None)
     def read(_):
         return time.time()
@@ -179,4 +445,4 @@ if __name__ == "__main__":
     cached = read(CMD_IMON)
     time.sleep(0.1)
     expired = read(CMD_IMON)  # should be different!
-    print "First: {}\nCached: {}\nExpired: {}".format(first, cached, expired)
+    print("First: {}\nCached: {}\nExpired: {}".format(first, cached, expired))
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run a device server owning the USB connection, sharing the board between processes
+connecting with the Socket device, e.g. the web interfaces started with --socket.
+"""
+
+import argparse
+import logging
+from core.Devices import USB, Dummy
+from core.DeviceServer import DeviceServer
+from core.constants import LOG_LVL_VERBOSE, DEVICE_SERVER_ADDRESS
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Device server for FL593FL laser diode driver eval board.')
+    parser.add_argument('-d', '--dummy', help='Use dummy device instead of USB connection.', action='store_true')
+    parser.add_argument('-v', '--verbose', help='Enable packet-level logging.', action='store_true')
+    parser.add_argument('-a', '--address', help="Unix socket path or host:port to serve at.",
+                        default=DEVICE_SERVER_ADDRESS)
+
+    cli_args = parser.parse_args()
+
+    logging.addLevelName(LOG_LVL_VERBOSE, "VERBOSE")
+    logging.basicConfig(level=LOG_LVL_VERBOSE if cli_args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log = logging.getLogger(__name__)
+
+    device_class = Dummy if cli_args.dummy else USB
+
+    with device_class() as dev:
+        server = DeviceServer(dev, cli_args.address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server.server_close()
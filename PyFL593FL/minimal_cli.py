@@ -15,13 +15,15 @@ be constructed from a return string.
 
 import argparse
 import logging
-from core.Devices import USB, Dummy
-from core.constants import LOG_LVL_VERBOSE
+from core.Devices import USB, Dummy, Socket
+from core.constants import LOG_LVL_VERBOSE, DEVICE_SERVER_ADDRESS
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Mini REPL for FL593FL laser diode driver eval board.')
     parser.add_argument('-d', '--dummy', help='Use dummy device instead of USB connection.', action='store_true')
     parser.add_argument('-v', '--verbose', help='Enable packet-level logging.', action='store_true')
+    parser.add_argument('-s', '--socket', help='Use the device of a device server, by default at {}.'.format(
+        DEVICE_SERVER_ADDRESS), nargs='?', const=DEVICE_SERVER_ADDRESS)
 
     cli_args = parser.parse_args()
 
@@ -30,27 +32,30 @@ if __name__ == '__main__':
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     log = logging.getLogger(__name__)
 
-    device_class = Dummy if cli_args.dummy else USB
+    if cli_args.socket:
+        device_class = lambda: Socket(address=cli_args.socket)
+    else:
+        device_class = Dummy if cli_args.dummy else USB
     with device_class() as dev:
         # Example usages:
         rsp = dev.transceive("STATUS READ MODEL")
         if rsp:
-            print "Response:", rsp
+            print("Response:", rsp)
 
         rsp = dev.transceive("STATUS READ ALARM")
         if rsp:
-            print "Response:", rsp
+            print("Response:", rsp)
 
         # Mini REPL
-        print "'q' to exit"
-        cmd = raw_input(">> ")
+        print("'q' to exit")
+        cmd = input(">> ")
         while cmd.upper() != 'Q':
             try:
                 rsp = dev.transceive(cmd)
-                print "<-", rsp
+                print("<-", rsp)
             except ValueError as error:
                 log.debug(error)
 
-            cmd = raw_input(">> ")
+            cmd = input(">> ")
 
 
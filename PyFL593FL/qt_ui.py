@@ -7,8 +7,6 @@ Created on 08 Apr 2014 2:14 PM
 """
 
 import sys
-if sys.hexversion > 0x03000000:
-    raise EnvironmentError('Python 3 not supported.')
 import argparse
 import logging
 from PyQt4 import QtGui, QtCore
@@ -49,7 +47,7 @@ class Main(QtGui.QMainWindow, object):
         self.stopwatch = QtCore.QElapsedTimer()
         self.stopwatch.start()
         self.running = True  # to prevent GUI refresh during device shutdown
-        self.gui_refresh_interval = 0
+        self.gui_refresh_interval = 30  # ms, redrawing only, the device is read by the poller
         self.elapsed = self.gui_refresh_interval if self.gui_refresh_interval > 0 else 30
         QtCore.QTimer.singleShot(0, self.initialize)  # fires when event loop starts
 
@@ -62,11 +60,14 @@ class Main(QtGui.QMainWindow, object):
 
         # add channels/initialize widgets now that we have a working connection
         self.status_widget.initialize(self.fl593fl)
-        self.channel_widgets = [ChannelWidget(self, n+1) for n in range(self.fl593fl.status.get_num_channels())]
+        self.channel_widgets = [ChannelWidget(self, n+1) for n in range(self.fl593fl.status.get_num_channels().value)]
         for widget in self.channel_widgets:
             self.ui.layout_channels.addWidget(widget)
             widget.initialize(self.fl593fl.channels[widget.num_channel])
 
+        # acquisition runs in the background, widgets are served from the register mirrors
+        self.fl593fl.start_polling()
+
         # start main refresh loop
         self.refresh()
 
@@ -79,10 +80,7 @@ class Main(QtGui.QMainWindow, object):
         self.elapsed = 0.8*self.elapsed + 0.2*self.stopwatch.restart()
         self.status_widget.set_fps(self.elapsed)
 
-        # have the device update itself fully
-        self.fl593fl.update()
-
-        # Refresh widgets
+        # Redraw widgets from the register mirrors, kept fresh by the poller
         self.status_widget.refresh()
         for widget in self.channel_widgets:
             widget.refresh()
@@ -8,7 +8,8 @@ Created on 14 Aug 2014 2:20 PM
 
 import logging
 from PyQt4 import QtGui, QtCore
-import ChannelWidgetUi
+from core.constants import EXPIRY_NEVER
+from . import ChannelWidgetUi
 
 
 class ChannelWidget(QtGui.QWidget, ChannelWidgetUi.Ui_Channel):
@@ -39,18 +40,22 @@ class ChannelWidget(QtGui.QWidget, ChannelWidgetUi.Ui_Channel):
         self.controlled_channel = channel
 
     def refresh(self):
-        if self.controlled_channel is not None:
-            assert self.controlled_channel.get_mode() is not None
-            if self.controlled_channel.get_mode():
+        """Redraw from the register mirror only, never reading the device from the GUI thread.
+        Skipped until all displayed registers were read once."""
+        channel = self.controlled_channel
+        if channel is not None and all(channel.age(op_code) is not None for op_code in channel.UPDATE_REGISTERS):
+            mode = channel.get_mode(max_age=EXPIRY_NEVER).value
+            assert mode is not None
+            if mode:
                 self.radio_CC.setChecked(True)
             else:
                 self.radio_CP.setChecked(True)
 
             # Raw current and power and setpoint values
-            imon = self.controlled_channel.get_imon()
-            pmon = self.controlled_channel.get_pmon()
-            limit = self.controlled_channel.get_limit()
-            setpoint = self.controlled_channel.get_setpoint()
+            imon = channel.get_imon(max_age=EXPIRY_NEVER).value
+            pmon = channel.get_pmon(max_age=EXPIRY_NEVER).value
+            limit = channel.get_limit(max_age=EXPIRY_NEVER).value
+            setpoint = channel.get_setpoint(max_age=EXPIRY_NEVER).value
 
             # Current and power levels
             self.progbar_imon.setValue(imon if int(imon) >= 0 else 0)
@@ -80,4 +80,4 @@ class Ui_MainWindow(object):
         self.actionQuit.setShortcut(_translate("MainWindow", "Ctrl+Q", None))
         self.actionReset.setText(_translate("MainWindow", "Reset", None))
 
-import icons_rc
+from . import icons_rc
@@ -7,7 +7,7 @@ Created on 14 Aug 2014 2:37 PM
 
 import logging
 from PyQt4 import QtGui, QtCore
-import StatusWidgetUi, icons_rc
+from . import StatusWidgetUi, icons_rc
 
 
 class StatusWidget(QtGui.QWidget, StatusWidgetUi.Ui_Status):
@@ -27,12 +27,12 @@ class StatusWidget(QtGui.QWidget, StatusWidgetUi.Ui_Status):
         assert device is not None
         self.device = None
         self.status_channel = device.status
-        if self.status_channel.get_model() is not None:
-            self.lbl_dev_name.setText(self.status_channel.get_model())
-        if self.status_channel.get_fw_version() is not None:
-            self.lbl_fw_ver.setText(self.status_channel.get_fw_version())
-        if self.status_channel.get_serial() is not None:
-            self.lbl_serial_num.setText(self.status_channel.get_serial())
+        if self.status_channel.get_model().value is not None:
+            self.lbl_dev_name.setText(self.status_channel.get_model().value)
+        if self.status_channel.get_fw_version().value is not None:
+            self.lbl_fw_ver.setText(self.status_channel.get_fw_version().value)
+        if self.status_channel.get_serial().value is not None:
+            self.lbl_serial_num.setText(self.status_channel.get_serial().value)
 
     def refresh(self):
         if self.status_channel is None:
@@ -44,12 +44,12 @@ class StatusWidget(QtGui.QWidget, StatusWidgetUi.Ui_Status):
 
     def refresh_enable_flags(self):
         """Update enable flag indicators for local, external and remote flags."""
-        self.toggle_laser_warning(self.status_channel.get_output_enable())
+        self.toggle_laser_warning(self.status_channel.get_output_enable().value)
 
-        self.set_enable_icon(self.lbl_external_icon, self.status_channel.get_external_enable())
-        self.set_enable_icon(self.lbl_output_icon, self.status_channel.get_output_enable())
-        self.set_enable_icon(self.lbl_local_icon, self.status_channel.get_local_enable())
-        self.push_REN.setChecked(self.status_channel.get_remote_enable())
+        self.set_enable_icon(self.lbl_external_icon, self.status_channel.get_external_enable().value)
+        self.set_enable_icon(self.lbl_output_icon, self.status_channel.get_output_enable().value)
+        self.set_enable_icon(self.lbl_local_icon, self.status_channel.get_local_enable().value)
+        self.push_REN.setChecked(self.status_channel.get_remote_enable().value)
 
     def toggle_remote_enable(self, state):
         """Toggle the state of the remote enable flag when toggling the checkbutton."""
@@ -200,4 +200,4 @@ class Ui_Status(object):
         self.lbl_fps.setText(_translate("Status", "0 Hz", None))
         self.lbl_fps_lbl.setText(_translate("Status", "Cadence:", None))
 
-import icons_rc
+from . import icons_rc
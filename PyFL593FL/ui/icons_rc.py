@@ -9,7 +9,7 @@
 
 from PyQt4 import QtCore
 
-qt_resource_data = "\
+qt_resource_data = b"\
 \x00\x00\x09\xe2\
 \x3c\
 \x3f\x78\x6d\x6c\x20\x76\x65\x72\x73\x69\x6f\x6e\x3d\x22\x31\x2e\
@@ -721,7 +721,7 @@ qt_resource_data = "\
 \
 "
 
-qt_resource_name = "\
+qt_resource_name = b"\
 \x00\x05\
 \x00\x6f\xa6\x53\
 \x00\x69\
@@ -751,7 +751,7 @@ qt_resource_name = "\
 \x00\x6e\x00\x61\x00\x62\x00\x6c\x00\x65\x00\x64\x00\x5f\x00\x74\x00\x72\x00\x75\x00\x65\x00\x2e\x00\x70\x00\x6e\x00\x67\
 "
 
-qt_resource_struct = "\
+qt_resource_struct = b"\
 \x00\x00\x00\x00\x00\x02\x00\x00\x00\x01\x00\x00\x00\x01\
 \x00\x00\x00\x00\x00\x02\x00\x00\x00\x05\x00\x00\x00\x02\
 \x00\x00\x00\x36\x00\x01\x00\x00\x00\x01\x00\x00\x09\xe6\
@@ -4,6 +4,7 @@
 
 import logging
 import tornado.escape
+import tornado.gen
 import tornado.ioloop
 import tornado.options
 import tornado.web
@@ -13,6 +14,8 @@ import os.path
 import uuid
 
 from tornado.options import define, options
+from core.Devices import AsyncDevice
+from core.Scheduling import CommandScheduler, SchedulerFull
 
 define("port", default=8889, help="run on the given port", type=int)
 define("debug", default=False, help="run in debug mode")
@@ -36,14 +39,14 @@ class Application(tornado.web.Application):
 
 class MainHandler(tornado.web.RequestHandler):
     def get(self):
-        self.render("index.html", messages=ChatSocketHandler.cache)
+        self.render("index.html")
 
 
 class ChatSocketHandler(tornado.websocket.WebSocketHandler):
     waiters = set()
     cache = []
     cache_size = 5
-    device = None
+    scheduler = None
 
     def get_compression_options(self):
         # Non-None enables compression with default options
@@ -52,10 +55,17 @@ class ChatSocketHandler(tornado.websocket.WebSocketHandler):
     def open(self):
         logging.info("New waiter connected")
         ChatSocketHandler.waiters.add(self)
+        if self.scheduler is not None:
+            self.scheduler.register(self, "{}:{}".format(self.request.remote_ip, id(self)))
+        # recent history, rendered by the client
+        for chat in ChatSocketHandler.cache:
+            self.write_message(chat)
 
     def on_close(self):
         logging.info("Waiter closed connection")
         ChatSocketHandler.waiters.remove(self)
+        if self.scheduler is not None:
+            logging.info("Waiter command counters: {}".format(self.scheduler.unregister(self)))
 
     @classmethod
     def update_cache(cls, chat):
@@ -72,31 +82,55 @@ class ChatSocketHandler(tornado.websocket.WebSocketHandler):
             except:
                 logging.error("Error sending message", exc_info=True)
 
+    @tornado.gen.coroutine
     def on_message(self, message):
         logging.debug("Got message {}".format(message))
-        assert self.device is not None
-
-        packet = self.device.transceive(self.decode_message(message), unpack=True)
-        logging.debug("Got {}".format(repr(packet)))
-        response = self.to_chat(json.dumps({"response": packet._asdict()}))
-        ChatSocketHandler.update_cache(response)
-        ChatSocketHandler.send_updates(response)
+        assert self.scheduler is not None
+
+        try:
+            commands = self.decode_message(message)
+        except ValueError as error:
+            logging.warning("Invalid message: {}".format(error))
+            self.write_message(self.to_chat([message], [error]))
+            return
+        try:
+            responses = yield self.scheduler.submit(self, commands, unpack=False)
+        except (SchedulerFull, ValueError) as error:
+            logging.warning(error)
+            # rejected as a whole, only the sender is told
+            self.write_message(self.to_chat(commands, [error] * len(commands)))
+            return
+        logging.debug("Got {}".format(responses))
+        chat = self.to_chat(commands, responses)
+        ChatSocketHandler.update_cache(chat)
+        ChatSocketHandler.send_updates(chat)
 
     @classmethod
     def decode_message(self, json_string):
-        return tornado.escape.json_decode(json_string)["body"]
-    
-    def to_chat(self, message):
-        chat = {"id": str(uuid.uuid4()), "body": message}
-        chat["html"] = tornado.escape.to_basestring(
-            self.render_string("message.html", message=chat))
-        return chat
+        """Commands in a message, the body is a command string or a list of them. Raises
+        ValueError if malformed."""
+        message = tornado.escape.json_decode(json_string)
+        body = message.get("body") if isinstance(message, dict) else None
+        commands = body if isinstance(body, list) else [body]
+        if not all(isinstance(command, str) for command in commands):
+            raise ValueError("Body is not a command string or a list of them")
+        return commands
+
+    def to_chat(self, commands, responses):
+        """Compact frame of the responses to a batch of commands, rendered by the client."""
+        return json.dumps({"id": str(uuid.uuid4()), "commands": commands,
+                           "responses": [None if isinstance(response, Exception) else response
+                                         for response in responses],
+                           "errors": [str(response) if isinstance(response, Exception) else None
+                                      for response in responses]})
 
 
 def main(device=None):
     app = Application()
     app.listen(options.port)
-    ChatSocketHandler.device = device
+    if device is not None:
+        ChatSocketHandler.scheduler = CommandScheduler(AsyncDevice(device))
+        ChatSocketHandler.scheduler.start()
     tornado.ioloop.IOLoop.instance().start()
 
 
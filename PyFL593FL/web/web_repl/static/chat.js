@@ -18,6 +18,11 @@ $(document).ready(function() {
 
 function newMessage(form) {
     var message = form.formToDict();
+    // several commands separated by ";" run as one batch
+    message.body = $.map(message.body.split(";"), $.trim).filter(function(command) {
+        return command.length > 0;
+    });
+    if (message.body.length == 0) return;
     updater.socket.send(JSON.stringify(message));
     form.find("input[type=text]").val("").select();
 }
@@ -46,7 +51,13 @@ var updater = {
     showMessage: function(message) {
         var existing = $("#m" + message.id);
         if (existing.length > 0) return;
-        var node = $(message.html);
+        var node = $("<div/>", {"class": "message", "id": "m" + message.id});
+        for (var idx = 0; idx < message.commands.length; idx++) {
+            var line = $("<div/>").text(message.commands[idx] + " \u2192 " +
+                (message.errors[idx] === null ? message.responses[idx] : message.errors[idx]));
+            if (message.errors[idx] !== null) line.addClass("error");
+            node.append(line);
+        }
         node.hide();
         $("#inbox").append(node);
         node.slideDown();
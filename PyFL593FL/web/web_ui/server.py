@@ -4,17 +4,54 @@
 
 import logging
 import tornado.escape
+import tornado.gen
 import tornado.ioloop
 import tornado.options
 import tornado.web
 import tornado.websocket
 import json
+import struct
+import collections
 import os.path
 
 from tornado.options import define, options
+from core.constants import *
+from core.util import FIXED_FRAMES, clock
+from core.Devices import AsyncDevice
+from core.Scheduling import CommandScheduler, SchedulerFull
 
 define("port", default=8889, help="run on the given port", type=int)
 define("debug", default=False, help="run in debug mode")
+define("rate", default=20., help="state updates per second read from the device and pushed to clients",
+       type=float)
+
+# Fields of the state frames pushed to clients, e.g. "LD1.imon", as (name, channel, op code)
+STATE_FIELDS = [('{}.{}'.format(CHANNEL_DICT_REV[channel], OP_CODE_DICT_REV[op_code].lower()), channel, op_code)
+                for channel, op_code in TELEMETRY_REGISTERS]
+ALL_FIELDS = (1 << len(STATE_FIELDS)) - 1
+
+# Binary state frames: sequence number and bitmask of the included fields, bit n for
+# STATE_FIELDS[n], followed by the values of the included fields as float32
+STATE_HEADER = struct.Struct('<II')
+
+# Outbound per client: messages queued behind the one being written before the client is
+# dropped, and how long a write may take before it is considered stalled and dropped
+OUTBOUND_QUEUE_SIZE = 32
+SLOW_CLIENT_TIMEOUT = 5.0
+
+
+def encode_state(seq, values, previous=None, fields=ALL_FIELDS):
+    """Binary state frame of the values of [fields] (bitmask) that differ from [previous],
+    None if there are none."""
+    mask = 0
+    changed = []
+    for index, value in enumerate(values):
+        if fields >> index & 1 and value is not None and (previous is None or value != previous[index]):
+            mask |= 1 << index
+            changed.append(value)
+    if not mask:
+        return None
+    return STATE_HEADER.pack(seq & 0xFFFFFFFF, mask) + struct.pack('<{}f'.format(len(changed)), *changed)
 
 
 class Application(tornado.web.Application):
@@ -22,6 +59,7 @@ class Application(tornado.web.Application):
         handlers = [
             (r"/", MainHandler),
             (r"/chatsocket", ChatSocketHandler),
+            (r"/stats", StatsHandler),
         ]
         settings = dict(
             cookie_secret="MYVERYOWNCOOKIESECRET",  # TODO Read from file
@@ -40,23 +78,91 @@ class MainHandler(tornado.web.RequestHandler):
         self.render("index.html")  # , messages=ChatSocketHandler.cache
 
 
+class StatsHandler(tornado.web.RequestHandler):
+    def get(self):
+        """Command counters of the connected clients."""
+        scheduler = ChatSocketHandler.scheduler
+        self.write({"clients": scheduler.counters() if scheduler is not None else {}})
+
+
+class StateBroadcaster(object):
+    """Single acquisition loop shared by all clients. Reads all state fields in one device batch
+    per tick and pushes the state to the subscribed clients, so the load on the device does
+    not depend on the number of clients. Ticks are skipped while the device is still busy
+    with the previous one. Clients get the fields changed since the last frame they got."""
+    def __init__(self, device, rate):
+        self.device = device  # AsyncDevice
+        self.busy = False
+        self.frames = [FIXED_FRAMES[TYPE_READ][channel][op_code] for _, channel, op_code in STATE_FIELDS]
+        self.seq = 0
+        self.values = [None] * len(STATE_FIELDS)  # last state, in order of STATE_FIELDS
+        self._callback = tornado.ioloop.PeriodicCallback(self.update, 1000. / rate)
+
+    def start(self):
+        self._callback.start()
+
+    def stop(self):
+        self._callback.stop()
+
+    @tornado.gen.coroutine
+    def update(self):
+        if self.busy or not ChatSocketHandler.waiters:
+            return
+        self.busy = True
+        try:
+            responses = yield self.device.transceive_many(self.frames)
+        except Exception:
+            logging.error("Error reading state", exc_info=True)
+            return
+        finally:
+            self.busy = False
+        previous = self.values
+        self.values = [response.value if response.end_code == ERR_OK else value
+                       for response, value in zip(responses, previous)]
+        self.seq += 1
+        # shared by all clients subscribed to everything that got the previous frame
+        frame = encode_state(self.seq, self.values, previous)
+        for waiter in list(ChatSocketHandler.waiters):
+            waiter.send_state(self.seq, self.values, frame)
+
+
 class ChatSocketHandler(tornado.websocket.WebSocketHandler):
     waiters = set()
     cache = []
     cache_size = 5
-    device = None
+    scheduler = None
+
+    def __init__(self, *args, **kwargs):
+        super(ChatSocketHandler, self).__init__(*args, **kwargs)
+        # state subscription, all fields at the server rate by default
+        self.fields = ALL_FIELDS
+        self.min_interval = 0.
+        self.last_sent = None
+        # state last pushed to this client
+        self.last_seq = None
+        self.last_values = None
+        # outbound, only one message is written at a time
+        self.outbound = collections.deque()  # messages waiting for the previous write
+        self.pending_state = None  # latest state waiting, as (seq, values, frame)
+        self.writing = None  # time the message being written was handed to the socket
 
     def get_compression_options(self):
-        # Non-None enables compression with default options
-        return {}
+        # No compression, deflating state frames of a few bytes costs more than it saves
+        return None
 
     def open(self):
         logging.info("New client connected")
         ChatSocketHandler.waiters.add(self)
+        if self.scheduler is not None:
+            self.scheduler.register(self, "{}:{}".format(self.request.remote_ip, id(self)))
+        # bit order of the binary state frames
+        self.send(json.dumps({"fields": [name for name, _, _ in STATE_FIELDS]}))
 
     def on_close(self):
         logging.info("Client closed connection")
-        ChatSocketHandler.waiters.remove(self)
+        ChatSocketHandler.waiters.discard(self)
+        if self.scheduler is not None:
+            logging.info("Client command counters: {}".format(self.scheduler.unregister(self)))
 
     @classmethod
     def update_cache(cls, item):
@@ -67,31 +173,150 @@ class ChatSocketHandler(tornado.websocket.WebSocketHandler):
     @classmethod
     def send_updates(cls, item):
         logging.debug("sending message to {} clients".format(len(cls.waiters)))
-        for waiter in cls.waiters:
+        for waiter in list(cls.waiters):
             try:
-                waiter.write_message(item)
+                waiter.send(item)
             except:
                 logging.error("Error sending message", exc_info=True)
 
+    @classmethod
+    def decode_message(cls, json_string):
+        """Message object, either with a "command" string or a "subscribe" object of the optional
+        "fields" (list of names) and "rate" (frames per second). Raises ValueError if malformed."""
+        message = tornado.escape.json_decode(json_string)
+        if not isinstance(message, dict):
+            raise ValueError("Message is not an object")
+        if "subscribe" in message:
+            subscription = message["subscribe"]
+            if not isinstance(subscription, dict) or not set(subscription) <= {"fields", "rate"}:
+                raise ValueError("Subscription takes fields and rate only")
+            fields = subscription.get("fields")
+            if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+                raise ValueError("Subscribed fields are not a list of names")
+            rate = subscription.get("rate")
+            if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or not rate >= 0):
+                raise ValueError("Subscribed rate is not a number >= 0")
+        elif not isinstance(message.get("command"), str):
+            raise ValueError("Message has neither a command string nor a subscription")
+        return message
+
+    def subscribe(self, fields=None, rate=None):
+        """Limit the state frames pushed to this client to [fields] and [rate] frames per second."""
+        names = [name for name, _, _ in STATE_FIELDS]
+        if fields is None:
+            self.fields = ALL_FIELDS
+        else:
+            unknown = set(fields).difference(names)
+            if unknown:
+                logging.warning("Unknown state fields: {}".format(", ".join(sorted(unknown))))
+            self.fields = sum(1 << names.index(field) for field in set(fields) - unknown)
+        self.min_interval = 1. / rate if rate else 0.
+        # start over with the full state of the subscribed fields
+        self.last_values = None
+
+    def send_state(self, seq, values, frame):
+        """Push the changes of the state [values] of tick [seq], unless this client got the previous
+        frame less than its interval ago. [frame] holds the changes since the previous tick.
+        While the previous frame is still being written, the latest state replaces any state
+        waiting to be pushed."""
+        now = clock()
+        if self.writing is not None and now - self.writing > SLOW_CLIENT_TIMEOUT:
+            self.drop("stalled for {:.1f} s".format(now - self.writing))
+            return
+        if self.last_sent is not None and now - self.last_sent < self.min_interval:
+            return
+        self.pending_state = seq, values, frame
+        self._flush()
+
+    def send(self, message, binary=False):
+        """Queue a message, e.g. a command response. Drops the client if its queue is full."""
+        if len(self.outbound) >= OUTBOUND_QUEUE_SIZE:
+            self.drop("{} messages queued".format(len(self.outbound)))
+            return
+        self.outbound.append((message, binary))
+        self._flush()
+
+    def drop(self, reason):
+        logging.warning("Dropping slow client {}: {}".format(self.request.remote_ip, reason))
+        ChatSocketHandler.waiters.discard(self)
+        self.outbound.clear()
+        self.pending_state = None
+        self.close()
+
+    def _flush(self):
+        """Write the next queued message, or else the pending state, once the previous write is done."""
+        if self.writing is not None:
+            return
+        if self.outbound:
+            message, binary = self.outbound.popleft()
+        elif self.pending_state is not None:
+            seq, values, message = self.pending_state
+            self.pending_state = None
+            binary = True
+            if self.fields != ALL_FIELDS or self.last_values is None or self.last_seq != seq - 1:
+                message = encode_state(seq, values, self.last_values, self.fields)
+            self.last_seq = seq
+            self.last_values = values
+            if message is None:
+                return
+            self.last_sent = clock()
+        else:
+            return
+        try:
+            future = self.write_message(message, binary=binary)
+        except tornado.websocket.WebSocketClosedError:
+            return
+        self.writing = clock()
+        tornado.ioloop.IOLoop.current().add_future(future, self._on_written)
+
+    def _on_written(self, future):
+        self.writing = None
+        self._flush()
+
+    @tornado.gen.coroutine
     def on_message(self, message):
         logging.debug("Got message {}".format(message))
-        assert self.device is not None
+        assert self.scheduler is not None
+
+        try:
+            message = self.decode_message(message)
+        except ValueError as error:
+            logging.warning("Invalid message: {}".format(error))
+            self.send(json.dumps({"error": str(error)}))
+            return
+        if "subscribe" in message:
+            self.subscribe(**message["subscribe"])
+            return
 
-        packet = self.device.transceive(self.decode_message(message), unpack=True)
+        try:
+            packet = yield self.scheduler.submit(self, message["command"], unpack=True)
+        except SchedulerFull as error:
+            logging.warning(error)
+            self.send(json.dumps({"error": str(error)}))
+            return
+        except (ValueError, KeyError) as error:
+            error = "Invalid command {}: {}".format(message["command"], error)
+            logging.warning(error)
+            self.send(json.dumps({"error": error}))
+            return
         logging.debug("Got {}".format(repr(packet)))
-        response = json.dumps({"response": packet._asdict()})
+        response = packet._asdict()
+        del response["string"]  # not used by the client
+        response["data"] = packet.data.decode('ascii', 'replace')
+        response = json.dumps({"response": response})
         ChatSocketHandler.update_cache(response)
         ChatSocketHandler.send_updates(response)
 
-    @staticmethod
-    def decode_message(json_string):
-        return tornado.escape.json_decode(json_string)["command"]
-
 
-def main(device=None):
+def main(device=None, rate=None):
     app = Application()
     app.listen(options.port)
-    ChatSocketHandler.device = device
+    if device is not None:
+        device = AsyncDevice(device)
+        broadcaster = StateBroadcaster(device, rate or options.rate)
+        broadcaster.start()
+        ChatSocketHandler.scheduler = CommandScheduler(device)
+        ChatSocketHandler.scheduler.start()
     tornado.ioloop.IOLoop.instance().start()
 
 
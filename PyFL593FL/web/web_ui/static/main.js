@@ -111,13 +111,17 @@ var socket_updater = {
     socket: null,
     alarms: ["#OUT", "#XEN", "#LEN", "#REN"],
     url: "ws://" + location.host + "/chatsocket",
-    iv: null,
+    // state pushed by the server, see StateBroadcaster in server.py
+    fields: ["STATUS.alarm", "LD1.setpoint", "LD1.limit", "LD1.imon", "LD1.pmon",
+             "LD2.setpoint", "LD2.limit", "LD2.imon", "LD2.pmon"],
+    rate: 20, // Hz, ought to be enough for starters
+    stateFields: [], // bit order of binary state frames, sent by the server on connect
 
     start: function() {
         socket_updater.socket = new WebSocket(this.url);
+        socket_updater.socket.binaryType = "arraybuffer";
 
         socket_updater.socket.onclose = function() {
-        window.clearInterval(socket_updater.iv)
             Materialize.toast("Connection failed", 3000);
             socket_updater.toggleConnectionState(false);
             setTimeout(function() {
@@ -126,14 +130,19 @@ var socket_updater = {
         };
 
         socket_updater.socket.onopen = function() {
-            socket_updater.iv = setInterval(onTimerTick, 50); // 20Hz update rate ought to be enough for starters
+            socket_updater.send(JSON.stringify({"subscribe": {"fields": socket_updater.fields,
+                                                              "rate": socket_updater.rate}}));
             //console.log(socket_updater.socket);
             Materialize.toast("Connection established", 3000);
             socket_updater.toggleConnectionState(true);
         };
 
         socket_updater.socket.onmessage = function(event) {
-            socket_updater.parseMessage(JSON.parse(event.data));
+            if (event.data instanceof ArrayBuffer) {
+                socket_updater.parseState(event.data);
+            } else {
+                socket_updater.parseMessage(JSON.parse(event.data));
+            }
         };
 
         socket_updater.socket.onerror = function(e) {
@@ -142,7 +151,29 @@ var socket_updater = {
 
     },
 
+    parseState: function(buffer) {
+        // sequence number and bitmask of the changed fields, followed by their float32 values
+        var view = new DataView(buffer);
+        var mask = view.getUint32(4, true);
+        var offset = 8;
+        for (var idx=0; idx < socket_updater.stateFields.length; idx++) {
+            if (mask & (1 << idx)) {
+                socket_updater.updateField(socket_updater.stateFields[idx], view.getFloat32(offset, true));
+                offset += 4;
+            }
+        }
+    },
+
     parseMessage: function(message) {
+        if (message.fields) {
+            socket_updater.stateFields = message.fields;
+            return;
+        }
+        if (message.error) {
+            Materialize.toast("ERROR: " + message.error, 3000);
+            return;
+        }
+
         var response = message.response;
         if (response.end_code) {
             console.log(response);
@@ -207,6 +238,19 @@ var socket_updater = {
         }
     },
 
+    updateField: function(name, value) {
+        var field = name.split(".");
+        if (field[0] == "STATUS") {
+            if (field[1] == "alarm") {
+                for (var idx=0; idx < socket_updater.alarms.length; idx++) {
+                    toggleBtn(socket_updater.alarms[idx], (value >> idx) & 1);
+                }
+            }
+            return;
+        }
+        updateSlider($(".channel"+field[0]).find('.slider.'+field[1]), value*1000);
+    },
+
     send: function(msg) {
         if (socket_updater.socket.readyState) socket_updater.socket.send(msg);
     },
@@ -235,21 +279,6 @@ function updateSlider(slider, value) {
     }
 };
 
-function onTimerTick() {
-    var status = ["alarm"];
-    var ld = ["setpoint", "limit", "imon", "pmon"];
-    for (var idx = 0; idx < status.length; idx++) {
-        socket_updater.send('{"command": "status read '+status[idx]+'"}');
-        }
-
-    for (var ch = 1; ch <= 2; ch++) {
-        for (var idx = 0; idx < ld.length; idx++) {
-            socket_updater.send('{"command": "LD'+ch+' read '+ld[idx]+'"}');
-        }
-    }
-
-};
-
 function toggleEnable (element) {
 	$(element).toggleClass("red");
 	$(element).children().toggleClass('mdi-content-clear');
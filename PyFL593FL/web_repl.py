@@ -10,13 +10,15 @@ Run webserver connecting to USB, send command/response from/to browser via webso
 import argparse
 import logging
 from web.web_repl.server import main
-from core.Devices import USB, Dummy
-from core.constants import LOG_LVL_VERBOSE
+from core.Devices import USB, Dummy, Socket
+from core.constants import LOG_LVL_VERBOSE, DEVICE_SERVER_ADDRESS
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Mini REPL for FL593FL laser diode driver eval board.')
     parser.add_argument('-d', '--dummy', help='Use dummy device instead of USB connection.', action='store_true')
     parser.add_argument('-v', '--verbose', help='Enable packet-level logging.', action='store_true')
+    parser.add_argument('-s', '--socket', help='Use the device of a device server, by default at {}.'.format(
+        DEVICE_SERVER_ADDRESS), nargs='?', const=DEVICE_SERVER_ADDRESS)
     parser.add_argument('-p', '--port', help="Port for web server.")
 
     cli_args = parser.parse_args()
@@ -26,7 +28,10 @@ if __name__ == '__main__':
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     log = logging.getLogger(__name__)
 
-    device_class = Dummy if cli_args.dummy else USB
+    if cli_args.socket:
+        device_class = lambda: Socket(address=cli_args.socket)
+    else:
+        device_class = Dummy if cli_args.dummy else USB
 
     with device_class() as dev:
         # FIXME: Pass on parameters (e.g. port)
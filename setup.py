@@ -28,7 +28,7 @@ setup(name='PyFL593FL',
       classifiers=['Development Status :: 3 - Alpha',
                    'Natural Language :: English',
                    'Operating System :: OS Independent',
-                   'Programming Language :: Python :: 2',
+                   'Programming Language :: Python :: 3',
                    'License :: OSI Approved :: MIT License',
                    'Topic :: Scientific/Engineering',
                    'Topic :: Scientific/Engineering :: Interface Engine/Protocol Translator',
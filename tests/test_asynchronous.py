@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import unittest
+
+from PyFL593FL.core.Asynchronous import AsyncFL593FL, asyncio
+from PyFL593FL.core.Devices import Dummy
+from PyFL593FL.core.constants import *
+
+
+@unittest.skipIf(asyncio is None, 'asyncio not available')
+class Test(unittest.TestCase):
+    """Unit tests for the asyncio facade"""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.fl593fl = self.loop.run_until_complete(AsyncFL593FL(loop=self.loop).connect(Dummy))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.fl593fl.close())
+        self.loop.close()
+
+    def test_calls(self):
+        """Channel calls and batches return awaitables of their results"""
+        run = self.loop.run_until_complete
+        self.assertIsInstance(run(self.fl593fl.ld1.get_imon()).value, float)
+        packets = run(self.fl593fl.ld1.read_many([CMD_IMON, CMD_PMON]))
+        self.assertEqual(sorted(packets), [CMD_IMON, CMD_PMON])
+        self.assertEqual(len(run(self.fl593fl.transceive_batch(['LD1 READ IMON', 'LD2 READ PMON']))), 2)
+
+    def test_cancelled_write(self):
+        """Writes complete even if the awaiting task is cancelled"""
+        registers = self.fl593fl.ld1.channel.registers
+        index = registers.index(TYPE_READ, CMD_SETPOINT)
+        version = registers.versions[index]
+        write = self.fl593fl.ld1.set_setpoint(0.)
+        self.assertTrue(write.cancel())
+        self.loop.run_until_complete(self.fl593fl.ld1.get_imon())
+        self.assertEqual(registers.versions[index], version + 1)
+
+    def test_updates(self):
+        """Acquired packets of the selected registers are iterated, until closed"""
+        updates = self.fl593fl.updates([(CHAN_LD1, CMD_IMON)])
+        self.loop.run_until_complete(self.fl593fl.snapshot(max_age=0))
+        packets = self.loop.run_until_complete(updates.__anext__())
+        self.assertEqual([(packet.channel, packet.op_code) for packet in packets], [(CHAN_LD1, CMD_IMON)])
+        updates.close()
+        self.assertRaises(StopAsyncIteration, self.loop.run_until_complete, updates.__anext__())
+
+
+if __name__ == '__main__':
+    unittest.main()
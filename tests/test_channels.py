@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import unittest
+import time
+
+from PyFL593FL.core.Channels import LaserChannel, StatusChannel
+from PyFL593FL.core.Devices import Dummy
+from PyFL593FL.core.fl593fl import FL593FL
+from PyFL593FL.core.util import decode_command
+from PyFL593FL.core.constants import *
+
+
+class CountingDummy(Dummy):
+    """Dummy device keeping track of the commands it received."""
+    def __init__(self, *args, **kwargs):
+        super(CountingDummy, self).__init__()
+        self.commands = []
+        self.batches = []
+
+    def transceive_many(self, frames):
+        self.batches.append(len(frames))
+        return super(CountingDummy, self).transceive_many(frames)
+
+    def transceive_frame(self, frame):
+        self.commands.append(decode_command(frame))
+        return super(CountingDummy, self).transceive_frame(frame)
+
+
+class FailingAlarmDummy(Dummy):
+    """Dummy device failing to read the alarm flags of the status channel, the first in a
+    snapshot, once [failing] is set."""
+    failing = False
+
+    def transceive_frame(self, frame):
+        response = super(FailingAlarmDummy, self).transceive_frame(frame)
+        if self.failing and response.op_code == CMD_ALARM:
+            return response._replace(end_code=ERR_BUSY, value=None)
+        return response
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the channel proxies"""
+
+    def setUp(self):
+        self.device = CountingDummy()
+        self.ld1 = LaserChannel(CHAN_LD1)
+        self.ld1.device = self.device
+        self.status = StatusChannel(CHAN_STATUS)
+        self.status.device = self.device
+
+    def test_register_mirror(self):
+        """Reads are served from the register mirror until they expire"""
+        self.ld1.get_limit()
+        self.ld1.get_limit()
+        self.assertEqual(len(self.device.commands), 1)
+        self.assertLess(self.ld1.age(CMD_LIMIT), EXPIRY_MEDIUM)
+        self.assertIsNone(self.ld1.age(CMD_LIMIT, op_type=TYPE_MAX))
+
+        self.ld1.get_limit(max_age=0.0)
+        self.assertEqual(len(self.device.commands), 2)
+        index = self.ld1.registers.index(TYPE_READ, CMD_LIMIT)
+        self.assertEqual(self.ld1.registers.versions[index], 2)
+
+        self.ld1.get_imon()
+        self.ld1.get_imon()
+        self.assertEqual(len(self.device.commands), 4, msg="IMON should never be cached by default!")
+
+    def test_write_through(self):
+        """Writes update the mirror from their response and expire dependent registers"""
+        self.ld1.set_setpoint(0.125)
+        self.assertEqual(self.ld1.get_setpoint().value, 125.)
+        self.assertEqual(len(self.device.commands), 1)
+
+        self.status.get_output_enable(max_age=1.0)
+        self.status.get_output_enable(max_age=1.0)
+        self.assertEqual(len(self.device.commands), 2)
+        self.status.set_remote_enable(True)
+        self.status.get_output_enable(max_age=1.0)
+        self.assertEqual([command.op_code for command in self.device.commands[2:]], [CMD_ENABLE, CMD_ALARM])
+
+    def test_revalidate(self):
+        """Expired values within the staleness window are returned while refreshed in the background"""
+        self.ld1.revalidate = True
+        first = self.ld1.get_limit()
+        index = self.ld1.registers.index(TYPE_READ, CMD_LIMIT)
+        self.ld1.registers.timestamps[index] -= EXPIRY_DICT[CMD_LIMIT] + STALE_DICT[CMD_LIMIT] / 2.
+        self.assertEqual(self.ld1.expired([index]), [index])
+        self.assertEqual(self.ld1.get_limit(), first)
+        time.sleep(0.05)
+        self.assertEqual(len(self.device.commands), 2, msg="Value not refreshed in the background!")
+        self.assertLess(self.ld1.age(CMD_LIMIT), EXPIRY_DICT[CMD_LIMIT])
+        self.assertEqual(self.ld1.expired([index], min_interval=1.0), [])
+
+    def test_read_many(self):
+        """Expired fields are read in a single batch"""
+        self.ld1.get_limit()
+        packets = self.ld1.read_many([CMD_IMON, CMD_LIMIT, CMD_SETPOINT])
+        self.assertEqual(sorted(packets), sorted([CMD_IMON, CMD_LIMIT, CMD_SETPOINT]))
+        self.assertEqual(packets[CMD_LIMIT].value * 1000., self.ld1.get_limit().value)
+        self.assertEqual(self.device.batches, [2])
+
+    def test_snapshot(self):
+        """A full snapshot of all channels is a single batch"""
+        fl593fl = FL593FL(device_class=CountingDummy)
+        fl593fl.device.batches = []
+        snapshot = fl593fl.snapshot()
+        self.assertEqual(sorted(snapshot), ['LD1', 'LD2', 'STATUS'])
+        self.assertEqual(sorted(snapshot['LD2']), sorted(LaserChannel.UPDATE_REGISTERS))
+        self.assertEqual(len(fl593fl.device.batches), 1)
+        self.assertIsNotNone(fl593fl.status.alarm_flags)
+
+    def test_snapshot_failure(self):
+        """Failed responses of one channel don't keep the others from being stored"""
+        fl593fl = FL593FL(device_class=FailingAlarmDummy)
+        registers = fl593fl.channels.ld2.registers
+        index = registers.index(TYPE_READ, CMD_IMON)
+        version = registers.versions[index]
+        fl593fl.device.failing = True
+        self.assertRaises(ValueError, fl593fl.snapshot, max_age=0.)
+        self.assertEqual(registers.versions[index], version + 1)
+
+    def test_readings(self):
+        """Getters return typed values with their acquisition time"""
+        model = self.status.get_model()
+        self.assertEqual(model.value, 'FL593-Dummy')
+        self.assertAlmostEqual(model.timestamp, time.time(), delta=1.0)
+        self.assertIsInstance(self.ld1.get_setpoint().value, float)
+        self.assertIsInstance(self.status.get_output_enable(max_age=0.005).value, bool)
+        self.assertRaises(ValueError, self.ld1.read, 0xFF)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import functools
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PyFL593FL.core.Devices import Dummy, Socket
+from PyFL593FL.core.DeviceServer import DeviceServer
+from PyFL593FL.core.fl593fl import FL593FL
+from PyFL593FL.core.util import FIXED_FRAMES, decode_command
+from PyFL593FL.core.constants import *
+
+
+class RecordingDummy(Dummy):
+    """Dummy device keeping the op types of the frames it got."""
+    def __init__(self, *args, **kwargs):
+        super(RecordingDummy, self).__init__(*args, **kwargs)
+        self.op_types = []
+
+    def transceive_frame(self, frame):
+        self.op_types.append(decode_command(frame).op_type)
+        return super(RecordingDummy, self).transceive_frame(frame)
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the device server and its Socket client"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.location = os.path.join(self.path, 'fl593fl.sock')
+        self.device = RecordingDummy()
+        self.server = DeviceServer(self.device, self.location)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.path)
+
+    def test_pipelining(self):
+        """Clients share the device, batches of requests are answered in order"""
+        frames = [FIXED_FRAMES[TYPE_READ][channel][op_code]
+                  for channel in (CHAN_LD1, CHAN_LD2) for op_code in (CMD_IMON, CMD_PMON, CMD_MODE)] * 100
+        results = []
+
+        def client():
+            with Socket(address=self.location) as device:
+                self.assertEqual(device.transceive('STATUS READ MODEL'), 'STATUS READ MODEL OK FL593-Dummy')
+                results.append([(packet.channel, packet.op_code) for packet in device.transceive_many(frames)])
+
+        threads = [threading.Thread(target=client) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expected = [(frame[1], frame[3]) for frame in frames]
+        self.assertEqual(results, [expected] * 3)
+
+    def test_shared_state_untouched(self):
+        """Clients attaching to and closing a shared device do not reset it"""
+        fl593fl = FL593FL(functools.partial(Socket, address=self.location))
+        fl593fl.channels.ld1.get_imon(max_age=0.)
+        fl593fl.close()
+        self.assertTrue(self.device.op_types)
+        self.assertNotIn(TYPE_WRITE, self.device.op_types)
+
+if __name__ == "__main__":
+    unittest.main()
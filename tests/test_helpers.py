@@ -3,8 +3,11 @@
 
 import unittest
 import time
+import threading
 
-from PyFL593FL.core.util import encode_command, memoize_with_expiry
+from PyFL593FL.core.util import encode_command, memoize_with_expiry, encode_packet, decode_packet, \
+    decode_command, encode_response, decode_response, format_packet, Packet, FIXED_FRAMES, parse_data, \
+    unpack_string
 from PyFL593FL.core.constants import *
 
 
@@ -19,7 +22,53 @@ class Test(unittest.TestCase):
     def test_decode_command(self):
         """Test command string decoding"""
         encode_command("status read model")
-        
+
+    def test_encode_packet(self):
+        """Binary encoding matches the encoded command string"""
+        frame = encode_packet(CHAN_LD1, TYPE_WRITE, CMD_SETPOINT, b'0.1')
+        self.assertEqual(len(frame), EP_PACK_OUT)
+        self.assertEqual(frame, encode_command("LD1 WRITE SETPOINT 0.1"))
+        self.assertEqual(list(frame[:7]), [DEV_TYPE, CHAN_LD1, TYPE_WRITE, CMD_SETPOINT, ord('0'), ord('.'), ord('1')])
+        self.assertRaises(ValueError, encode_packet, CHAN_LD1, TYPE_WRITE, 0xFF)
+        self.assertRaises(ValueError, encode_packet, CHAN_LD1, TYPE_WRITE, CMD_SETPOINT, b'0' * (LEN_DATA + 1))
+
+        command = decode_command(frame)
+        self.assertEqual((command.channel, command.op_type, command.op_code, command.data),
+                         (CHAN_LD1, TYPE_WRITE, CMD_SETPOINT, b'0.1'))
+        self.assertEqual(format_packet(command), "LD1 WRITE SETPOINT 0.1")
+
+    def test_fixed_frames(self):
+        """Precompiled frames are identical to freshly encoded ones"""
+        for op_type in [TYPE_READ, TYPE_MIN, TYPE_MAX]:
+            for channel in CHANNEL_DICT.values():
+                for op_code in OP_CODE_DICT.values():
+                    self.assertEqual(FIXED_FRAMES[op_type][channel][op_code],
+                                     encode_packet(channel, op_type, op_code))
+        self.assertNotIn(TYPE_WRITE, FIXED_FRAMES)
+
+    def test_decode_packet(self):
+        """Response frames decode into packets and their string representation"""
+        packet = Packet(channel=CHAN_LD2, op_type=TYPE_READ, op_code=CMD_IMON, end_code=ERR_OK,
+                        data=b'0.125', value=0.125, timestamp=None, string=None)
+        response = encode_response(packet)
+        self.assertEqual(len(response), EP_PACK_IN)
+        decoded = decode_packet(response)
+        self.assertAlmostEqual(decoded.timestamp, time.time(), delta=1.0)
+        self.assertEqual(decoded._replace(timestamp=None), packet)
+        self.assertEqual(decode_response(response), "LD2 READ IMON OK 0.125")
+        self.assertRaises(ValueError, decode_packet, response[:3])
+        self.assertEqual(decode_packet(memoryview(bytearray(response)))._replace(timestamp=None), packet)
+
+    def test_parse_data(self):
+        """Data fields are parsed into typed values per op code"""
+        self.assertEqual(parse_data(CMD_ALARM, b'1011000000'), 0b1101)
+        self.assertEqual(parse_data(CMD_IMON, b'0.125'), 0.125)
+        self.assertEqual(parse_data(CMD_CHANCT, b'2'), 2)
+        self.assertEqual(parse_data(CMD_MODEL, b'FL593'), 'FL593')
+        self.assertIsNone(parse_data(CMD_PMON, b''))
+        self.assertEqual(unpack_string("LD1 READ LIMIT OK 0.25").value, 0.25)
+        self.assertIsNone(unpack_string("LD1 READ LIMIT DATA 0.25").value)
+
     # def test_doctest(self):
         # import doctest
         # import my_program.utils
@@ -39,5 +88,40 @@ class Test(unittest.TestCase):
         expired = read(CMD_IMON)  # should be different!
         self.assertNotEqual(first, expired, msg="Cache not randomized!")
 
+    def test_memoize_single_flight(self):
+        """Concurrent cache misses on the same key share a single call"""
+        calls = []
+
+        @memoize_with_expiry(0.5)
+        def read(op_code):
+            calls.append(op_code)
+            time.sleep(0.05)
+            return time.time()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(read(CMD_IMON))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [CMD_IMON])
+        self.assertEqual(len(set(results)), 1)
+
+    def test_memoize_max_age(self):
+        """Per call max_age and min_interval override the expiry"""
+        @memoize_with_expiry(0.05)
+        def read(op_code):
+            return time.time()
+
+        first = read(CMD_IMON)
+        time.sleep(0.01)
+        self.assertEqual(first, read(CMD_IMON, max_age=1.0))
+        self.assertNotEqual(first, read(CMD_IMON, max_age=0.0))
+        second = read(CMD_IMON)
+        time.sleep(0.06)
+        self.assertEqual(second, read(CMD_IMON, min_interval=1.0))
+        self.assertEqual(second, read(CMD_IMON, max_age=0.0, min_interval=1.0))
+        self.assertNotEqual(second, read(CMD_IMON))
+
 if __name__ == "__main__":
     unittest.main()
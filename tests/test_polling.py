@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import unittest
+import time
+
+from PyFL593FL.core.Devices import Dummy
+from PyFL593FL.core.fl593fl import FL593FL
+from PyFL593FL.core.constants import *
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the background poller"""
+
+    def setUp(self):
+        self.fl593fl = FL593FL(device_class=Dummy)
+
+    def tearDown(self):
+        self.fl593fl.stop_polling()
+
+    def test_poller(self):
+        """Subscribed registers are polled at their rate and served from the mirror"""
+        polled = []
+        self.fl593fl.sinks.append(polled.extend)
+        poller = self.fl593fl.start_polling(subscribe_all=False)
+        poller.subscribe(CHAN_LD1, CMD_IMON, interval=0.02)
+        poller.subscribe(CHAN_STATUS, CMD_MODEL)
+        time.sleep(0.15)
+        op_codes = [packet.op_code for packet in polled]
+        self.assertEqual(op_codes.count(CMD_MODEL), 1)
+        self.assertTrue(4 <= op_codes.count(CMD_IMON) <= 9, msg=op_codes)
+        self.assertLess(self.fl593fl.channels.ld1.age(CMD_IMON), 0.04)
+
+        poller.unsubscribe(CHAN_LD1, CMD_IMON)
+        time.sleep(0.03)
+        del polled[:]
+        time.sleep(0.05)
+        self.assertEqual(polled, [])
+
+    def test_resubscribe(self):
+        """Subscribing again does not revive old jobs, the fastest remaining interval applies"""
+        polled = []
+        self.fl593fl.sinks.append(polled.extend)
+        poller = self.fl593fl.start_polling(subscribe_all=False)
+        for _ in range(5):
+            poller.subscribe(CHAN_LD1, CMD_IMON, interval=0.05)
+            poller.unsubscribe(CHAN_LD1, CMD_IMON, interval=0.05)
+        poller.subscribe(CHAN_LD1, CMD_IMON, interval=0.05)
+        poller.subscribe(CHAN_LD1, CMD_IMON, interval=0.01)
+        poller.unsubscribe(CHAN_LD1, CMD_IMON, interval=0.01)
+        time.sleep(0.02)
+        del polled[:]
+        time.sleep(0.5)
+        self.assertTrue(8 <= len(polled) <= 12, msg=len(polled))
+
+if __name__ == "__main__":
+    unittest.main()
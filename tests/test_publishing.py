@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import shutil
+import time
+import tempfile
+import unittest
+
+from PyFL593FL.core.Publishing import Publisher, Subscriber, zmq
+from PyFL593FL.core.util import Packet
+from PyFL593FL.core.constants import *
+
+
+def fake_packets(t_start, num_samples):
+    return [Packet(channel=CHAN_LD1, op_type=TYPE_READ, op_code=CMD_PMON, end_code=ERR_OK, data=b'',
+                   value=n * 0.5, timestamp=t_start + n, string=None) for n in range(num_samples)]
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the telemetry stream"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.location = os.path.join(self.path, 'telemetry.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_socket(self):
+        """Frames reach subscribers, subscribers falling behind are dropped"""
+        publisher = Publisher(self.location, transport='socket')
+        publisher.start()
+        subscriber = Subscriber(self.location, transport='socket')
+        stalled = Subscriber(self.location, transport='socket')
+        while len(publisher._subscribers) < 2:
+            time.sleep(0.001)
+        publisher.push(fake_packets(100., 3))
+        self.assertEqual(subscriber.receive(), (1, [(100., CHAN_LD1, CMD_PMON, 0.), (101., CHAN_LD1, CMD_PMON, 0.5),
+                                                    (102., CHAN_LD1, CMD_PMON, 1.)]))
+        # fill the buffers of the stalled subscriber, while the other one keeps up
+        seq = 1
+        while publisher.num_disconnected == 0:
+            publisher.push(fake_packets(100., 100))
+            seq, _ = subscriber.receive()
+        publisher.push(fake_packets(100., 1))
+        self.assertEqual(subscriber.receive()[0], seq + 1)
+        publisher.stop()
+        subscriber.close()
+        stalled.close()
+
+    @unittest.skipIf(zmq is None, "ZMQ not available")
+    def test_zmq(self):
+        """Frames reach ZMQ subscribers"""
+        publisher = Publisher(self.location, transport='zmq')
+        publisher.start()
+        subscriber = Subscriber(self.location, transport='zmq')
+        # subscriptions take a moment to propagate
+        frame = None
+        while frame is None:
+            publisher.push(fake_packets(100., 1))
+            if subscriber._socket.poll(10):
+                frame = subscriber.receive()
+        self.assertEqual(frame[1], [(100., CHAN_LD1, CMD_PMON, 0.)])
+        publisher.stop()
+        subscriber.close()
+
+if __name__ == "__main__":
+    unittest.main()
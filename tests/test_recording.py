@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PyFL593FL.core.Recording import Recorder, Session, read_samples, np, SAMPLES_FILE, RECORD_DTYPE
+from PyFL593FL.core.util import Packet
+from PyFL593FL.core.constants import *
+
+
+def fake_packets(t_start, num_samples, channel=CHAN_LD1, op_code=CMD_PMON):
+    return [Packet(channel=channel, op_type=TYPE_READ, op_code=op_code, end_code=ERR_OK, data=b'',
+                   value=n * 0.001, timestamp=t_start + n * 0.01, string=None) for n in range(num_samples)]
+
+
+@unittest.skipIf(np is None, "NumPy not available")
+class Test(unittest.TestCase):
+    """Unit tests for the recording engine"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_recording(self):
+        """Recorded samples can be read back, also from a truncated file"""
+        recorder = Recorder(self.path)
+        recorder.start()
+        recorder.push(fake_packets(100., 10))
+        recorder.push(fake_packets(100., 5, channel=CHAN_LD2, op_code=CMD_MODEL))  # not recorded
+        recorder.stop()
+        self.assertEqual(recorder.num_written, 10)
+
+        samples = read_samples(self.path)
+        self.assertEqual(len(samples), 10)
+        self.assertAlmostEqual(samples['timestamp'][-1], 100.09)
+        self.assertEqual(list(samples['channel']), [CHAN_LD1] * 10)
+
+        # crash mid-record
+        with open(os.path.join(self.path, SAMPLES_FILE), 'ab') as samples_file:
+            samples_file.write(b'\x00' * (RECORD_DTYPE.itemsize // 2))
+        self.assertEqual(len(read_samples(self.path)), 10)
+        recorder.start()
+        recorder.push(fake_packets(101., 10))
+        recorder.stop()
+        self.assertEqual(len(read_samples(self.path)), 20)
+
+    def test_range(self):
+        """Range queries over indexed segments and the unindexed tail"""
+        recorder = Recorder(self.path, segment_size=4)
+        recorder.start()
+        recorder.push(fake_packets(100., 10))
+        recorder.stop()
+        # continue the session, the open segment is picked up
+        recorder.start()
+        recorder.push(fake_packets(100.1, 5) + fake_packets(100.1, 5, channel=CHAN_LD2))
+        recorder.stop()
+
+        session = Session(self.path)
+        self.assertEqual(list(session.index()['count']), [4] * 5)
+        self.assertEqual(len(session.tail()), 0)
+        self.assertEqual(len(session.range(0., 200.)), 20)
+        samples = session.range(100.045, 100.075, channel=CHAN_LD1, op_code=CMD_PMON)
+        self.assertEqual(len(samples), 3)
+        self.assertEqual(len(session.range(100.1, 100.14, channel=CHAN_LD2)), 5)
+        self.assertEqual(len(session.range(200., 300.)), 0)
+
+    def test_resume_oversized_tail(self):
+        """A tail of a full segment or more is indexed when the session is resumed"""
+        recorder = Recorder(self.path, segment_size=8)
+        recorder.start()
+        recorder.push(fake_packets(100., 6))
+        recorder.stop()
+        # smaller segments than the unindexed tail already holds
+        recorder = Recorder(self.path, segment_size=4)
+        recorder.start()
+        recorder.push(fake_packets(100.06, 6))
+        recorder.stop()
+        self.assertEqual(recorder.num_written, 6)
+
+        session = Session(self.path)
+        self.assertEqual(list(session.index()['count']), [6, 4])
+        self.assertEqual(len(session.tail()), 2)
+        self.assertEqual(len(session.range(0., 200.)), 12)
+
+    def test_pyramid(self):
+        """Downsampled levels and picking a level by point budget"""
+        recorder = Recorder(self.path)
+        recorder.start()
+        packets = fake_packets(100., 250)
+        for start in range(0, 250, 30):
+            recorder.push(packets[start:start + 30])
+        recorder.stop()
+
+        session = Session(self.path)
+        level1 = session._level(CHAN_LD1, CMD_PMON, 1)
+        self.assertEqual(len(level1), 25)
+        self.assertAlmostEqual(level1['max'][0], 0.009)
+        self.assertAlmostEqual(level1['mean'][0], 0.0045)
+        # incomplete buckets are written at the end of the session
+        self.assertEqual(list(session._level(CHAN_LD1, CMD_PMON, 2)['count']), [100, 100, 50])
+        level3 = session._level(CHAN_LD1, CMD_PMON, 3)
+        self.assertEqual(list(level3['count']), [250])
+        self.assertAlmostEqual(level3['mean'][0], 0.1245, places=5)
+        self.assertAlmostEqual(level3['t_end'][0], 102.49)
+
+        self.assertEqual(len(session.overview(CHAN_LD1, CMD_PMON, 0., 200., 1000)), 250)
+        self.assertEqual(len(session.overview(CHAN_LD1, CMD_PMON, 0., 200., 30)), 25)
+        self.assertEqual(len(session.overview(CHAN_LD1, CMD_PMON, 0., 200., 3)), 3)
+        self.assertEqual(len(session.overview(CHAN_LD1, CMD_PMON, 100.51, 100.58, 3)), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import unittest
+
+from PyFL593FL.core.Devices import Device, AsyncDevice
+from PyFL593FL.core.Scheduling import CommandScheduler, SchedulerFull, is_priority
+
+
+class EchoDevice(Device):
+    """Generic echoing device keeping the commands it got."""
+    def __init__(self):
+        super(EchoDevice, self).__init__()
+        self.commands = []
+
+    def transceive(self, command, unpack=False):
+        self.commands.append(command)
+        return super(EchoDevice, self).transceive(command, unpack)
+
+    def transceive_batch(self, commands, unpack=False):
+        self.commands.extend(commands)
+        return super(EchoDevice, self).transceive_batch(commands, unpack)
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the command scheduler"""
+
+    def setUp(self):
+        self.device = EchoDevice()
+        self.async_device = AsyncDevice(self.device)
+
+    def tearDown(self):
+        self.async_device.close()
+
+    def test_fairness(self):
+        """Clients take turns, commands turning the output off go first"""
+        scheduler = CommandScheduler(self.async_device, rate=1000., burst=1, queue_size=5)
+        scheduler.register('flood')
+        scheduler.register('other')
+        futures = [scheduler.submit('flood', 'LD1 READ IMON') for _ in range(5)]
+        futures += [scheduler.submit('other', 'LD2 READ IMON') for _ in range(2)]
+        futures.append(scheduler.submit('other', 'STATUS WRITE ENABLE 0'))
+        self.assertRaises(SchedulerFull, scheduler.submit('flood', 'LD1 READ PMON').result)
+        scheduler.start()
+        for future in futures:
+            future.result(timeout=1.)
+        scheduler.stop()
+
+        self.assertEqual(self.device.commands[:5], ['STATUS WRITE ENABLE 0', 'LD1 READ IMON', 'LD2 READ IMON',
+                                                    'LD1 READ IMON', 'LD2 READ IMON'])
+        counters = scheduler.counters()
+        self.assertEqual(counters['flood']['rejected'], 1)
+        self.assertEqual(counters['flood']['completed'], 5)
+        self.assertEqual(counters['other']['priority'], 1)
+        self.assertTrue(is_priority('ld1 write setpoint 0.000'))
+        self.assertFalse(is_priority('LD1 WRITE SETPOINT 0.1'))
+
+    def test_batch(self):
+        """Batches run at once, invalid commands fail on their own"""
+        scheduler = CommandScheduler(self.async_device, rate=1000., burst=1, max_batch=3)
+        scheduler.register('client')
+        scheduler.start()
+        responses = scheduler.submit('client', ['LD1 READ IMON', 'LD1 READ BOGUS', 'LD2 READ PMON']).result(1.)
+        self.assertRaises(ValueError, scheduler.submit('client', ['LD1 READ IMON'] * 4).result, 1.)
+        scheduler.stop()
+
+        self.assertEqual(responses[0], 'LD1 READ IMON')
+        self.assertIsInstance(responses[1], ValueError)
+        self.assertEqual(responses[2], 'LD2 READ PMON')
+        counters = scheduler.counters()['client']
+        self.assertEqual((counters['completed'], counters['failed'], counters['rejected']), (2, 1, 4))
+
+    def test_priority_batch(self):
+        """Only the commands of a batch turning the output off skip the queue"""
+        scheduler = CommandScheduler(self.async_device, rate=10., burst=1, queue_size=4, priority_size=2)
+        scheduler.register('flood')
+        scheduler.register('other')
+        batch = ['LD1 READ IMON'] * 3 + ['STATUS WRITE ENABLE 0']
+        floods = [scheduler.submit('flood', batch) for _ in range(20)]
+        read = scheduler.submit('other', 'LD2 READ IMON')
+        scheduler.start()
+        self.assertEqual(read.result(timeout=0.5), 'LD2 READ IMON')
+        self.assertEqual(floods[0].result(timeout=1.), batch)
+        scheduler.stop()
+
+        self.assertEqual(self.device.commands[:3], ['STATUS WRITE ENABLE 0'] * 2 + ['LD1 READ IMON'])
+        self.assertIn('LD2 READ IMON', self.device.commands[:8])
+        self.assertIsInstance(floods[-1].result(timeout=1.)[0], SchedulerFull)
+        self.assertIsInstance(floods[-1].result(timeout=1.)[3], SchedulerFull)
+        counters = scheduler.counters()['flood']
+        self.assertEqual(counters['priority'], 2)
+        self.assertEqual(counters['rejected'], 16 * 3 + 18)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import os
+import math
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PyFL593FL.core.SharedState import SharedState, StateReader, STATE_SEQ, STATE_SEQ_OFFSET
+from PyFL593FL.core.util import Packet
+from PyFL593FL.core.constants import *
+
+
+def fake_packet(channel, op_code, value, timestamp):
+    return Packet(channel=channel, op_type=TYPE_READ, op_code=op_code, end_code=ERR_OK, data=b'',
+                  value=value, timestamp=timestamp, string=None)
+
+
+class Test(unittest.TestCase):
+    """Unit tests for the shared memory state block"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.state = SharedState(os.path.join(self.path, 'state'))
+        self.state.start()
+
+    def tearDown(self):
+        self.state.stop()
+        shutil.rmtree(self.path)
+
+    def test_read(self):
+        """Readers see the latest value of each register, NaN before the first one"""
+        reader = StateReader(self.state.path)
+        self.assertEqual(reader.registers, list(TELEMETRY_REGISTERS))
+        self.assertTrue(math.isnan(reader.read(CHAN_LD1, CMD_PMON).value))
+        self.state.push([fake_packet(CHAN_LD1, CMD_PMON, 1.5, 10.), fake_packet(CHAN_LD1, CMD_PMON, 2.5, 11.),
+                         fake_packet(CHAN_LD2, CMD_IMON, 0.25, 12.)])
+        self.assertEqual(reader.read(CHAN_LD1, CMD_PMON), (2.5, 11.))
+        seq, values = reader.snapshot()
+        self.assertEqual(seq, 2)
+        self.assertEqual(values[CHAN_LD2, CMD_IMON], (0.25, 12.))
+        reader.close()
+
+    def test_consistent(self):
+        """Snapshots never mix values of different updates"""
+        reader = StateReader(self.state.path)
+        done = threading.Event()
+
+        def write():
+            for n in range(2000):
+                self.state.push([fake_packet(channel, op_code, n, n) for channel, op_code in TELEMETRY_REGISTERS])
+            done.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        while not done.is_set():
+            seq, values = reader.snapshot()
+            if seq == 0:
+                continue  # NaN before the first update
+            self.assertEqual(len(set(value for value, _ in values.values())), 1)
+        writer.join()
+        self.assertEqual(reader.snapshot()[1][CHAN_LD1, CMD_PMON], (1999., 1999.))
+        reader.close()
+
+    def test_stale_writer(self):
+        """Readers detect a writer that died mid update, stopped or was replaced"""
+        reader = StateReader(self.state.path, timeout=0.05)
+        self.assertIsNone(reader.age())
+        self.state.push([fake_packet(CHAN_LD1, CMD_PMON, 1.5, 10.)])
+        self.assertLess(reader.age(), 1.)
+        # crash between the two counter increments
+        STATE_SEQ.pack_into(self.state._map, STATE_SEQ_OFFSET, self.state.seq + 1)
+        self.assertRaises(IOError, reader.read, CHAN_LD1, CMD_PMON)
+        self.assertFalse(reader.replaced())
+        self.state.stop()
+        self.assertTrue(reader.replaced())
+        self.state.start()
+        self.assertTrue(reader.replaced())
+        reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
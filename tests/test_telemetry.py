@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import unittest
+
+from PyFL593FL.core.Telemetry import RingBuffer, np
+from PyFL593FL.core.Devices import Dummy
+from PyFL593FL.core.fl593fl import FL593FL
+from PyFL593FL.core.constants import *
+
+
+@unittest.skipIf(np is None, "NumPy not available")
+class Test(unittest.TestCase):
+    """Unit tests for the telemetry ring buffers"""
+
+    def test_ring_buffer(self):
+        """The last samples are contiguous views, also after wrapping around"""
+        ring = RingBuffer(4, np.float32)
+        self.assertEqual(len(ring.last()[0]), 0)
+        for n in range(3):
+            ring.append(float(n), n * 10)
+        self.assertEqual(list(ring.last()[1]), [0, 10, 20])
+        for n in range(3, 7):
+            ring.append(float(n), n * 10)
+        timestamps, values = ring.last()
+        self.assertEqual(list(timestamps), [3., 4., 5., 6.])
+        self.assertEqual(list(ring.last(2)[1]), [50, 60])
+        self.assertIs(values.base, ring.values)
+        self.assertEqual(list(ring.window(3.5, 5.)[0]), [4., 5.])
+
+    def test_acquisition(self):
+        """Polled values end up in the telemetry history"""
+        fl593fl = FL593FL(device_class=Dummy)
+        telemetry = fl593fl.enable_telemetry(capacity=16)
+        fl593fl.snapshot(max_age=0.)
+        fl593fl.snapshot(max_age=0.)
+        timestamps, values = telemetry.last(CHAN_LD1, CMD_IMON)
+        self.assertEqual(len(timestamps), 2)
+        self.assertEqual(values.dtype, np.float32)
+        self.assertEqual(telemetry.last(CHAN_STATUS, CMD_ALARM)[1].dtype, np.uint16)
+        self.assertEqual(values[-1], np.float32(fl593fl.channels.ld1.read(CMD_IMON, max_age=1.).value))
+
+if __name__ == "__main__":
+    unittest.main()